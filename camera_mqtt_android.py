@@ -18,13 +18,46 @@ python3 camera_mqtt_android.py
 """
 
 import paho.mqtt.client as mqtt
+from paho.mqtt.properties import Properties
+from paho.mqtt.packettypes import PacketTypes
 import subprocess
+import shutil
 import os
 import time
 import requests
 from datetime import datetime
-import base64
 import json
+import logging
+import uuid
+import socket
+import hashlib
+import zlib
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# orjson es opcional: serializa más rápido y devuelve bytes, que paho publica
+# sin recodificar. Sin él se usa json de la biblioteca estándar.
+try:
+    import orjson
+
+    def dumps(obj):
+        return orjson.dumps(obj)
+
+    def loads(data):
+        return orjson.loads(data)
+except ImportError:
+    def dumps(obj):
+        return json.dumps(obj)
+
+    def loads(data):
+        return json.loads(data)
+
+# Pillow es opcional: sin él las fotos se envían tal como salen de la cámara
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
 
 # ============================================================================
 # CONFIGURACIÓN MQTT
@@ -35,6 +68,13 @@ MQTT_BROKER = "broker.hivemq.com"
 MQTT_PORT = 1883
 MQTT_KEEPALIVE = 60
 
+# Sesión persistente: el broker conserva la suscripción y los QoS 1 en vuelo
+# durante este tiempo tras una desconexión (segundos)
+MQTT_SESSION_EXPIRY = 3600
+
+# Archivo donde se guarda el client_id estable de este teléfono
+CLIENT_ID_PATH = os.path.expanduser("~/.fire_detection_client_id")
+
 # Topics MQTT
 MQTT_TOPIC_COMANDO_CAMARA = "unsa/fire_detection/comando_camara"  # Recibe comandos
 MQTT_TOPIC_FOTO = "unsa/fire_detection/foto"  # Envía foto
@@ -54,12 +94,71 @@ INTERVALO_FOTOS = 2  # Segundos entre cada foto
 CAPTURAR_AUDIO = False  # ❌ Audio no funciona en este dispositivo
 CAPTURAR_VIDEO = False  # ❌ termux-camera-video no disponible
 
-# Directorio para archivos temporales
-TEMP_DIR = "/data/data/com.termux/files/home/fire_detection_temp"
+# Reducción de fotos antes de enviar (lado mayor en píxeles y calidad JPEG)
+FOTO_MAX_LADO = 1280
+CALIDAD_JPEG = 72
+
+# Distancia de Hamming (de 64 bits) bajo la cual una foto de la ráfaga se
+# considera igual a la anterior y no se reenvía
+UMBRAL_DUPLICADO = 4
+
+# Tamaño de cada chunk binario publicado por MQTT (bytes crudos, sin base64)
+CHUNK_SIZE = 60000
+
+# Nivel zlib para audio/video sin comprimir (1 = rápido, barato en batería)
+NIVEL_COMPRESION = 1
+
+# Mensajes QoS>0 que pueden estar en vuelo sin PUBACK
+MQTT_MAX_INFLIGHT = 100
+
+# Cada cuántos chunks se espera a que paho escriba el anterior en el socket
+# (contrapresión sin time.sleep: la cola interna de paho no tiene límite)
+CHUNKS_POR_ESPERA = 16
+
+# Binarios de Termux:API resueltos una sola vez (None si no están instalados)
+TERMUX_PHOTO_BIN = shutil.which("termux-camera-photo")
+TERMUX_AUDIO_BIN = shutil.which("termux-microphone-record")
+TERMUX_VIDEO_BIN = shutil.which("termux-camera-video")
+
+# Anillo de rutas fijas para las fotos capturadas: termux-camera-photo
+# sobrescribe el archivo y no se acumulan temporales si falla un envío.
+# Debe superar las fotos que pueden estar en vuelo (cola de envío + 2)
+SLOTS_CAPTURA = 5
+PREFIJO_SLOT = "captura_slot_"
+
+# Directorio para archivos temporales: por defecto el tmp de Termux ($TMPDIR,
+# usr/tmp) en lugar de home, para no leer y escribir cada captura en la flash
+# del almacenamiento persistente. Se puede forzar con FIRE_DETECTION_TEMP_DIR
+TEMP_DIR = os.environ.get("FIRE_DETECTION_TEMP_DIR") or os.path.join(
+    os.environ.get("TMPDIR", "/data/data/com.termux/files/usr/tmp"),
+    "fire_detection"
+)
+
+# Logging en lugar de print: los mensajes por chunk quedan en DEBUG y no se
+# escriben a la terminal de Termux con el nivel por defecto
+logging.basicConfig(level=logging.INFO, format='%(message)s')
+log = logging.getLogger(__name__)
 
 # Cliente MQTT global
 mqtt_client = None
 
+# Cola entre la captura y el hilo de envío: la cámara toma la siguiente foto
+# mientras la anterior se publica por MQTT
+cola_envio = queue.Queue(maxsize=2)
+errores_envio = 0
+
+# Siguiente posición del anillo de fotos (solo lo usa el hilo de captura)
+contador_slot = 0
+
+# Hash perceptual y timestamp de la última foto enviada en la ráfaga actual
+hash_anterior = None
+timestamp_anterior = None
+
+# Una sola captura a la vez: termux-camera-photo falla si se invoca en paralelo
+# y paho puede reentregar el comando CAPTURAR (QoS 1)
+executor_captura = ThreadPoolExecutor(max_workers=1, thread_name_prefix="captura")
+captura_en_curso = threading.Event()
+
 # ============================================================================
 # INICIALIZACIÓN
 # ============================================================================
@@ -67,43 +166,68 @@ mqtt_client = None
 # Crear directorio temporal si no existe
 os.makedirs(TEMP_DIR, exist_ok=True)
 
-print("=" * 60)
-print("🎥 Cámara Automática MQTT - UNSA Fire Detection")
-print("=" * 60)
-print(f"📁 Directorio temporal: {TEMP_DIR}")
-print(f"🌐 Broker MQTT: {MQTT_BROKER}:{MQTT_PORT}")
-print(f"📡 Topic de comandos: {MQTT_TOPIC_COMANDO_CAMARA}")
-print()
+log.info("=" * 60)
+log.info("🎥 Cámara Automática MQTT - UNSA Fire Detection")
+log.info("=" * 60)
+log.info(f"📁 Directorio temporal: {TEMP_DIR}")
+log.info(f"🌐 Broker MQTT: {MQTT_BROKER}:{MQTT_PORT}")
+log.info(f"📡 Topic de comandos: {MQTT_TOPIC_COMANDO_CAMARA}")
+if not TERMUX_PHOTO_BIN:
+    log.warning("⚠️  termux-camera-photo no encontrado. Instala: pkg install termux-api")
+log.info("")
 
 # ============================================================================
 # FUNCIONES DE CAPTURA
 # ============================================================================
 
+def estado_archivo(path):
+    """Retorna (mtime_ns, tamaño) del archivo o None si no existe"""
+    try:
+        st = os.stat(path)
+        return (st.st_mtime_ns, st.st_size)
+    except OSError:
+        return None
+
 def capturar_foto():
-    """Captura una foto usando termux-camera-photo"""
+    """
+    Captura una foto usando termux-camera-photo.
+    Escribe sobre la siguiente ruta del anillo SLOTS_CAPTURA en lugar de
+    crear un archivo nuevo por captura.
+    """
+    global contador_slot
+
+    if not TERMUX_PHOTO_BIN:
+        log.error("✗ termux-camera-photo no está disponible")
+        return None
+
     try:
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        foto_path = os.path.join(TEMP_DIR, f"captura_{timestamp}.jpg")
+        foto_path = os.path.join(TEMP_DIR, f"{PREFIJO_SLOT}{contador_slot % SLOTS_CAPTURA}.jpg")
+        contador_slot += 1
+        
+        # El slot puede tener una foto anterior: solo cuenta si cambió
+        estado_previo = estado_archivo(foto_path)
         
-        print(f"📸 Capturando foto...")
+        log.info(f"📸 Capturando foto...")
         
+        # Sin pipes: la salida de termux no se usa
         result = subprocess.run(
-            ["termux-camera-photo", "-c", str(CAMARA_ID), foto_path],
-            capture_output=True,
-            text=True,
+            [TERMUX_PHOTO_BIN, "-c", str(CAMARA_ID), foto_path],
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
             timeout=10
         )
         
-        if result.returncode == 0 and os.path.exists(foto_path):
-            size = os.path.getsize(foto_path)
-            print(f"✓ Foto capturada: {size} bytes")
+        estado = estado_archivo(foto_path)
+        if result.returncode == 0 and estado and estado != estado_previo:
+            log.info(f"✓ Foto capturada: {estado[1]} bytes")
             return foto_path
         else:
-            print(f"✗ Error al capturar foto: {result.stderr}")
+            log.error(f"✗ Error al capturar foto (código {result.returncode})")
             return None
             
     except Exception as e:
-        print(f"✗ Excepción al capturar foto: {e}")
+        log.error(f"✗ Excepción al capturar foto: {e}")
         return None
 
 def probar_formatos_audio(duracion=3):
@@ -119,21 +243,31 @@ def probar_formatos_audio(duracion=3):
         ("wav", "wav"),          # WAV
     ]
     
-    print(f"🔍 Probando formatos de audio disponibles...")
+    if not TERMUX_AUDIO_BIN:
+        log.error("✗ termux-microphone-record no está disponible")
+        return None
+
+    log.info(f"🔍 Probando formatos de audio disponibles...")
     
     for extension, encoder in formatos:
         try:
             test_path = os.path.join(TEMP_DIR, f"test_audio.{extension}")
             
             # Construir comando
-            cmd = ["termux-microphone-record", "-f", test_path, "-l", str(duracion)]
+            cmd = [TERMUX_AUDIO_BIN, "-f", test_path, "-l", str(duracion)]
             if encoder:
                 cmd.extend(["-e", encoder])
             
-            print(f"   Probando {extension.upper()} {'con encoder ' + encoder if encoder else '(por defecto)'}...", end=" ")
+            log.info(f"   Probando {extension.upper()} {'con encoder ' + encoder if encoder else '(por defecto)'}...")
             
             # Lanzar grabación
-            subprocess.run(cmd, capture_output=True, timeout=2)
+            subprocess.run(
+                cmd,
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+                timeout=2
+            )
             
             # Esperar a que termine
             time.sleep(duracion + 2)
@@ -142,20 +276,20 @@ def probar_formatos_audio(duracion=3):
             if os.path.exists(test_path):
                 size = os.path.getsize(test_path)
                 if size > 50000:  # Al menos 50KB = tiene audio real
-                    print(f"✅ FUNCIONA ({size} bytes)")
+                    log.info(f"      ✅ FUNCIONA ({size} bytes)")
                     # Limpiar archivo de prueba
                     os.remove(test_path)
                     return (extension, encoder)
                 else:
-                    print(f"❌ Muy pequeño ({size} bytes)")
+                    log.error(f"      ❌ Muy pequeño ({size} bytes)")
                     os.remove(test_path)
             else:
-                print(f"❌ No se creó")
+                log.error(f"      ❌ No se creó")
         
         except Exception as e:
-            print(f"❌ Error: {e}")
+            log.error(f"❌ Error: {e}")
     
-    print(f"⚠️  Ningún formato funcionó correctamente")
+    log.warning(f"⚠️  Ningún formato funcionó correctamente")
     return None
 
 def grabar_audio(duracion=5):
@@ -169,6 +303,10 @@ def grabar_audio(duracion=5):
     - El archivo se llena progresivamente
     - Debemos esperar manualmente a que termine
     """
+    if not TERMUX_AUDIO_BIN:
+        log.error("✗ termux-microphone-record no está disponible")
+        return None
+
     try:
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         
@@ -177,29 +315,31 @@ def grabar_audio(duracion=5):
         encoder = None
         audio_path = os.path.join(TEMP_DIR, f"audio_{timestamp}.{extension}")
         
-        print(f"🎤 Iniciando grabación de audio ({duracion} segundos)...")
-        print(f"   Formato: {extension.upper()}")
+        log.info(f"🎤 Iniciando grabación de audio ({duracion} segundos)...")
+        log.info(f"   Formato: {extension.upper()}")
         
         # Construir comando
-        cmd = ["termux-microphone-record", "-f", audio_path, "-l", str(duracion)]
+        cmd = [TERMUX_AUDIO_BIN, "-f", audio_path, "-l", str(duracion)]
         if encoder:
             cmd.extend(["-e", encoder])
         
         # Lanzar comando (retorna inmediatamente, pero la grabación continúa)
-        result = subprocess.run(
+        subprocess.run(
             cmd,
-            capture_output=True,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
             timeout=3  # Solo esperamos que el comando se lance
         )
         
         # El comando ya se lanzó, ahora DEBEMOS ESPERAR a que termine la grabación
-        print(f"   ⏱️  Grabación en progreso... esperando {duracion} segundos")
-        print(f"   💡 El icono de micrófono debe estar activo ahora")
+        log.info(f"   ⏱️  Grabación en progreso... esperando {duracion} segundos")
+        log.info(f"   💡 El icono de micrófono debe estar activo ahora")
         
         # Esperar la duración completa + margen de seguridad
         time.sleep(duracion + 2)
         
-        print(f"   ⏹️  Grabación completada, verificando archivo...")
+        log.info(f"   ⏹️  Grabación completada, verificando archivo...")
         
         # Ahora sí verificar el archivo
         if os.path.exists(audio_path):
@@ -207,29 +347,29 @@ def grabar_audio(duracion=5):
             time.sleep(1)
             
             size = os.path.getsize(audio_path)
-            print(f"✓ Audio grabado: {size} bytes (~{size/1024:.1f} KB)")
+            log.info(f"✓ Audio grabado: {size} bytes (~{size/1024:.1f} KB)")
             
             if size < 50000:  # Menos de 50KB es sospechoso para 5 segundos
-                print(f"   ⚠️  Archivo muy pequeño, puede estar corrupto")
-                print(f"   💡 Ejecuta en Termux: python3 -c 'from camera_mqtt_android import probar_formatos_audio; probar_formatos_audio()'")
+                log.warning(f"   ⚠️  Archivo muy pequeño, puede estar corrupto")
+                log.info(f"   💡 Ejecuta en Termux: python3 -c 'from camera_mqtt_android import probar_formatos_audio; probar_formatos_audio()'")
                 # Aún así retornamos el archivo por si sirve
             
             return audio_path
         else:
-            print(f"✗ No se pudo crear el archivo de audio")
+            log.error(f"✗ No se pudo crear el archivo de audio")
             return None
             
     except subprocess.TimeoutExpired:
-        print(f"⚠️  Timeout al lanzar comando, pero puede estar grabando...")
+        log.warning(f"⚠️  Timeout al lanzar comando, pero puede estar grabando...")
         # Intentar esperar de todas formas
         time.sleep(duracion + 2)
         if os.path.exists(audio_path):
             size = os.path.getsize(audio_path)
-            print(f"✓ Audio grabado (con timeout): {size} bytes")
+            log.info(f"✓ Audio grabado (con timeout): {size} bytes")
             return audio_path
         return None
     except Exception as e:
-        print(f"✗ Excepción al grabar audio: {e}")
+        log.error(f"✗ Excepción al grabar audio: {e}")
         return None
 
 def grabar_video(duracion=5):
@@ -239,46 +379,41 @@ def grabar_video(duracion=5):
     NOTA: termux-camera-video puede NO estar disponible en todas las versiones.
     Si no existe, intenta actualizar: pkg upgrade termux-api
     """
+    # Verificar si el comando existe (resuelto al importar el módulo)
+    if not TERMUX_VIDEO_BIN:
+        log.error(f"❌ termux-camera-video no está disponible en este dispositivo")
+        log.info(f"   Intenta: pkg upgrade termux-api")
+        return None
+
     try:
-        # Primero verificar si el comando existe
-        result_check = subprocess.run(
-            ["which", "termux-camera-video"],
-            capture_output=True,
-            text=True
-        )
-        
-        if result_check.returncode != 0:
-            print(f"❌ termux-camera-video no está disponible en este dispositivo")
-            print(f"   Intenta: pkg upgrade termux-api")
-            return None
-        
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         video_path = os.path.join(TEMP_DIR, f"video_{timestamp}.mp4")
         
-        print(f"🎥 Grabando video ({duracion} segundos)...")
-        print(f"   Comando: termux-camera-video -c {CAMARA_ID} -s 1280x720 {video_path}")
+        log.info(f"🎥 Grabando video ({duracion} segundos)...")
+        log.info(f"   Comando: termux-camera-video -c {CAMARA_ID} -s 1280x720 {video_path}")
         
         # Iniciar grabación en background
         proceso = subprocess.Popen(
-            ["termux-camera-video", 
+            [TERMUX_VIDEO_BIN,
              "-c", str(CAMARA_ID),
              "-s", "1280x720",  # HD 720p (balance entre calidad y tamaño)
              video_path],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,  # Un PIPE sin leer puede llenarse y bloquear
+            stderr=subprocess.DEVNULL
         )
         
         # Esperar la duración especificada
-        print(f"   ⏱️  Grabando... (esperando {duracion} segundos)")
+        log.info(f"   ⏱️  Grabando... (esperando {duracion} segundos)")
         time.sleep(duracion)
         
         # Detener la grabación enviando SIGTERM
-        print(f"   ⏹️  Deteniendo grabación...")
+        log.info(f"   ⏹️  Deteniendo grabación...")
         proceso.terminate()
         try:
             proceso.wait(timeout=3)
         except subprocess.TimeoutExpired:
-            print(f"   ⚠️  Forzando cierre...")
+            log.warning(f"   ⚠️  Forzando cierre...")
             proceso.kill()
             proceso.wait()
         
@@ -289,17 +424,17 @@ def grabar_video(duracion=5):
         if os.path.exists(video_path):
             size = os.path.getsize(video_path)
             if size > 50000:  # Al menos 50KB para considerar válido
-                print(f"✓ Video grabado: {size} bytes (~{size/1024/1024:.1f} MB)")
+                log.info(f"✓ Video grabado: {size} bytes (~{size/1024/1024:.1f} MB)")
                 return video_path
             else:
-                print(f"✗ Video demasiado pequeño ({size} bytes), probablemente error")
+                log.error(f"✗ Video demasiado pequeño ({size} bytes), probablemente error")
                 return None
         else:
-            print(f"✗ No se pudo crear el archivo de video")
+            log.error(f"✗ No se pudo crear el archivo de video")
             return None
             
     except Exception as e:
-        print(f"✗ Excepción al grabar video: {e}")
+        log.error(f"✗ Excepción al grabar video: {e}")
         return None
 
 def capturar_secuencia_fotos(cantidad=5, intervalo=1):
@@ -307,313 +442,518 @@ def capturar_secuencia_fotos(cantidad=5, intervalo=1):
     Alternativa al video: Captura una secuencia rápida de fotos.
     Útil cuando termux-camera-video no está disponible.
     """
+    if not TERMUX_PHOTO_BIN:
+        log.error("✗ termux-camera-photo no está disponible")
+        return None
+
     try:
         fotos = []
         timestamp_base = datetime.now().strftime("%Y%m%d_%H%M%S")
         
-        print(f"📸 Capturando secuencia de {cantidad} fotos...")
+        log.info(f"📸 Capturando secuencia de {cantidad} fotos...")
         
         for i in range(cantidad):
             foto_path = os.path.join(TEMP_DIR, f"secuencia_{timestamp_base}_{i+1:02d}.jpg")
             
-            print(f"   Foto {i+1}/{cantidad}...")
+            log.info(f"   Foto {i+1}/{cantidad}...")
             
             result = subprocess.run(
-                ["termux-camera-photo", "-c", str(CAMARA_ID), foto_path],
-                capture_output=True,
-                text=True,
+                [TERMUX_PHOTO_BIN, "-c", str(CAMARA_ID), foto_path],
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
                 timeout=10
             )
             
             if result.returncode == 0 and os.path.exists(foto_path):
                 size = os.path.getsize(foto_path)
-                print(f"   ✓ {size} bytes")
+                log.info(f"   ✓ {size} bytes")
                 fotos.append(foto_path)
             else:
-                print(f"   ✗ Error en foto {i+1}")
+                log.error(f"   ✗ Error en foto {i+1}")
             
             # Esperar antes de la siguiente (excepto la última)
             if i < cantidad - 1:
                 time.sleep(intervalo)
         
         if fotos:
-            print(f"✓ Secuencia capturada: {len(fotos)} fotos")
+            log.info(f"✓ Secuencia capturada: {len(fotos)} fotos")
             return fotos
         else:
-            print(f"✗ No se pudo capturar ninguna foto de la secuencia")
+            log.error(f"✗ No se pudo capturar ninguna foto de la secuencia")
             return None
             
     except Exception as e:
-        print(f"✗ Excepción al capturar secuencia: {e}")
+        log.error(f"✗ Excepción al capturar secuencia: {e}")
         return None
 
-def convertir_a_base64(filepath):
-    """Convierte un archivo a base64"""
+def reducir_foto(foto_path):
+    """
+    Reescala y recomprime la foto en el mismo archivo antes de publicarla.
+    termux-camera-photo entrega JPEG a resolución completa (3-6 MB); para el
+    modelo del servidor basta con FOTO_MAX_LADO px a calidad CALIDAD_JPEG.
+    Si Pillow no está instalado o algo falla, se deja la foto original.
+    """
+    if Image is None:
+        return
+
     try:
-        with open(filepath, 'rb') as f:
-            return base64.b64encode(f.read()).decode('utf-8')
+        size_original = os.path.getsize(foto_path)
+        with Image.open(foto_path) as im:
+            # Aplicar la rotación EXIF antes de perder los metadatos
+            im = ImageOps.exif_transpose(im)
+            im.thumbnail((FOTO_MAX_LADO, FOTO_MAX_LADO), Image.LANCZOS)
+            im.convert("RGB").save(
+                foto_path, "JPEG",
+                quality=CALIDAD_JPEG, optimize=True, progressive=True
+            )
+        log.info(f"🗜️  Foto reducida: {size_original} → {os.path.getsize(foto_path)} bytes")
     except Exception as e:
-        print(f"✗ Error al convertir a base64: {e}")
+        log.warning(f"⚠️  No se pudo reducir la foto, se envía original: {e}")
+
+def hash_perceptual(foto_path):
+    """
+    Calcula un hash de diferencias (dHash) de 64 bits con Pillow.
+    Fotos casi iguales (escena estática) dan hashes a pocos bits de
+    distancia aunque los JPEG no sean idénticos byte a byte.
+    Retorna None si Pillow no está disponible.
+    """
+    if Image is None:
+        return None
+
+    try:
+        with Image.open(foto_path) as im:
+            pixeles = list(im.convert("L").resize((9, 8), Image.BILINEAR).getdata())
+    except Exception as e:
+        log.warning(f"⚠️  No se pudo calcular el hash de la foto: {e}")
+        return None
+
+    valor = 0
+    for fila in range(8):
+        for col in range(8):
+            izquierda = pixeles[fila * 9 + col]
+            derecha = pixeles[fila * 9 + col + 1]
+            valor = (valor << 1) | (izquierda > derecha)
+    return valor
+
+def es_duplicada(foto_path, timestamp):
+    """
+    Compara la foto con la anterior de la ráfaga.
+    Retorna el timestamp de la foto original si es casi idéntica, o None.
+    """
+    global hash_anterior, timestamp_anterior
+
+    valor = hash_perceptual(foto_path)
+    if valor is None:
         return None
 
-def dividir_base64(data, chunk_size=50000):
-    """Divide base64 en chunks para MQTT (límite de mensaje)"""
-    return [data[i:i+chunk_size] for i in range(0, len(data), chunk_size)]
+    if hash_anterior is not None and bin(valor ^ hash_anterior).count("1") < UMBRAL_DUPLICADO:
+        return timestamp_anterior
+
+    hash_anterior = valor
+    timestamp_anterior = timestamp
+    return None
+
+def calcular_sha256(filepath):
+    """Calcula el sha256 de un archivo leyendo por bloques (memoria constante)"""
+    h = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for bloque in iter(lambda: f.read(CHUNK_SIZE), b''):
+            h.update(bloque)
+    return h.hexdigest()
+
+def es_formato_comprimido(filepath):
+    """
+    Detecta por los bytes mágicos si el archivo ya está comprimido
+    (JPEG, PNG, MP4/M4A/3GP, MP3). Comprimirlo otra vez no ahorra nada.
+    """
+    with open(filepath, 'rb') as f:
+        cabecera = f.read(12)
+    return (
+        cabecera.startswith(b'\xff\xd8\xff')           # JPEG
+        or cabecera.startswith(b'\x89PNG')               # PNG
+        or cabecera[4:8] == b'ftyp'                       # MP4 / M4A / 3GP
+        or cabecera.startswith(b'ID3')                    # MP3 con tag
+        or cabecera[:2] in (b'\xff\xfb', b'\xff\xf3')   # MP3 sin tag
+    )
 
 # ============================================================================
 # FUNCIONES MQTT
 # ============================================================================
 
-def enviar_por_mqtt(foto_path, audio_path, video_path=None):
+def publicar_archivo(topic_base, filepath, mime, timestamp, extra=None):
+    """
+    Publica un archivo como bytes crudos por MQTT (sin base64 ni JSON).
+
+    Primero se envía la metadata en JSON a "{topic_base}/metadata" y luego
+    cada chunk binario a "{topic_base}/chunk/{timestamp}/{chunk_id}".
+    El archivo se lee de a CHUNK_SIZE bytes: nunca se carga completo en memoria.
+    Los formatos sin comprimir (p. ej. WAV) se envían con cada chunk
+    comprimido por separado con zlib.
+    """
+    try:
+        size = os.path.getsize(filepath)
+        sha256 = calcular_sha256(filepath)
+        comprimir = not es_formato_comprimido(filepath)
+    except Exception as e:
+        log.error(f"✗ Error al leer archivo: {e}")
+        return False
+
+    total_chunks = max(1, -(-size // CHUNK_SIZE))  # ceil(size / CHUNK_SIZE)
+
+    metadata = {
+        "timestamp": timestamp,
+        "dispositivo": "camara_mqtt_android",
+        "mime": mime,
+        "size": size,
+        "total_chunks": total_chunks,
+        "chunk_size": CHUNK_SIZE,
+        "sha256": sha256,
+        "compresion": "zlib" if comprimir else None
+    }
+    if extra:
+        metadata.update(extra)
+
+    mqtt_client.publish(
+        f"{topic_base}/metadata",
+        dumps(metadata),
+        qos=1
+    )
+    log.info(f"✓ Metadata enviada ({size} bytes)")
+
+    log.info(f"📡 Enviando {mime} en {total_chunks} chunk(s)...")
+
+    # Los chunks van con QoS 0 (son idempotentes gracias al chunk_id y el
+    # servidor detecta pérdidas con total_chunks). Solo el último viaja con
+    # QoS 1 como centinela de fin de envío.
+    ultimo = total_chunks - 1
+    info = None
+    # Un solo buffer reutilizado para todos los chunks (readinto, sin copias).
+    # paho copia los QoS 0 al paquete dentro de publish(); el último (QoS 1)
+    # se guarda para reintentos, así que ese sí se pasa como bytes propios.
+    buffer = bytearray(CHUNK_SIZE)
+    vista = memoryview(buffer)
+    with open(filepath, 'rb') as f:
+        for i in range(total_chunks):
+            leidos = f.readinto(buffer)
+            if comprimir:
+                chunk = zlib.compress(vista[:leidos], NIVEL_COMPRESION)
+            elif i == ultimo or leidos < CHUNK_SIZE:
+                chunk = bytes(vista[:leidos])
+            else:
+                chunk = buffer
+            info = mqtt_client.publish(
+                f"{topic_base}/chunk/{timestamp}/{i}",
+                chunk,
+                qos=1 if i == ultimo else 0
+            )
+
+            log.debug(f"  Chunk {i+1}/{total_chunks} enviado")
+
+            # Muestreo de contrapresión: el ritmo lo marca el socket TCP,
+            # no un reloj de pared
+            if (i + 1) % CHUNKS_POR_ESPERA == 0 and i != ultimo:
+                info.wait_for_publish(timeout=30)
+
+    if info is not None:
+        info.wait_for_publish(timeout=30)
+
+    return True
+
+def enviar_por_mqtt(foto_path, audio_path, video_path=None, timestamp=None, fin=None):
     """
     Envía foto/video y audio por MQTT al servidor.
     Divide en chunks si es necesario.
+    Si no se indica `timestamp` (ISO), se toma el momento del envío.
+    `fin` son campos extra de la metadata que marcan el cierre de la secuencia.
     """
     try:
-        print(f"\n📤 Preparando envío por MQTT...")
+        log.info(f"\n📤 Preparando envío por MQTT...")
         
-        # Convertir a base64
-        foto_base64 = convertir_a_base64(foto_path) if foto_path else None
-        audio_base64 = convertir_a_base64(audio_path) if audio_path else None
-        video_base64 = convertir_a_base64(video_path) if video_path else None
-        
-        if not foto_base64 and not video_base64:
-            print("✗ No hay foto ni video para enviar")
+        if not foto_path and not video_path:
+            log.error("✗ No hay foto ni video para enviar")
             return False
         
-        # Preparar metadata
-        metadata = {
-            "timestamp": datetime.now().isoformat(),
-            "dispositivo": "camara_mqtt_android",
-            "tiene_audio": audio_base64 is not None,
-            "tiene_video": video_base64 is not None,
-            "tipo": "video" if video_base64 else "foto"
+        # Mismo timestamp para foto/video y audio: el servidor los asocia por él
+        if timestamp is None:
+            timestamp = datetime.now().isoformat()
+        extra = {
+            "tiene_audio": audio_path is not None,
+            "tiene_video": video_path is not None,
+            "tipo": "video" if video_path else "foto"
         }
+        if fin:
+            extra.update(fin)
         
-        # Enviar metadata primero
-        topic_base = MQTT_TOPIC_VIDEO if video_base64 else MQTT_TOPIC_FOTO
-        mqtt_client.publish(
-            f"{topic_base}/metadata",
-            json.dumps(metadata),
-            qos=1
-        )
-        print(f"✓ Metadata enviada")
-        
-        # Enviar video o foto (puede dividirse en chunks)
-        if video_base64:
-            # Enviar video
-            video_chunks = dividir_base64(video_base64)
-            total_chunks = len(video_chunks)
-            
-            print(f"📡 Enviando video en {total_chunks} chunk(s)...")
-            
-            for i, chunk in enumerate(video_chunks):
-                payload = {
-                    "chunk_id": i,
-                    "total_chunks": total_chunks,
-                    "data": chunk,
-                    "timestamp": metadata["timestamp"]
-                }
-                
-                mqtt_client.publish(
-                    MQTT_TOPIC_VIDEO,
-                    json.dumps(payload),
-                    qos=1
-                )
-                
-                print(f"  Chunk {i+1}/{total_chunks} enviado")
-                time.sleep(0.1)  # Pequeña pausa entre chunks
+        # Enviar video o foto
+        if video_path:
+            exito = publicar_archivo(MQTT_TOPIC_VIDEO, video_path, "video/mp4", timestamp, extra)
         else:
-            # Enviar foto
-            foto_chunks = dividir_base64(foto_base64)
-            total_chunks = len(foto_chunks)
-            
-            print(f"📡 Enviando foto en {total_chunks} chunk(s)...")
-            
-            for i, chunk in enumerate(foto_chunks):
-                payload = {
-                    "chunk_id": i,
-                    "total_chunks": total_chunks,
-                    "data": chunk,
-                    "timestamp": metadata["timestamp"]
-                }
-                
+            reducir_foto(foto_path)
+
+            # Escena estática: solo se avisa al servidor, sin reenviar la foto
+            original = es_duplicada(foto_path, timestamp)
+            if original:
                 mqtt_client.publish(
-                    MQTT_TOPIC_FOTO,
-                    json.dumps(payload),
+                    f"{MQTT_TOPIC_FOTO}/metadata",
+                    dumps({
+                        "timestamp": timestamp,
+                        "dispositivo": "camara_mqtt_android",
+                        "duplicate_of": original,
+                        **(fin or {})
+                    }),
                     qos=1
                 )
-                
-                print(f"  Chunk {i+1}/{total_chunks} enviado")
-                time.sleep(0.1)  # Pequeña pausa entre chunks
+                log.info(f"♻️  Foto casi idéntica a {original}, no se reenvía")
+                return True
+
+            exito = publicar_archivo(MQTT_TOPIC_FOTO, foto_path, "image/jpeg", timestamp, extra)
+        
+        if not exito:
+            return False
         
         # Enviar audio si existe
-        if audio_base64:
-            audio_chunks = dividir_base64(audio_base64)
-            total_audio_chunks = len(audio_chunks)
-            
-            print(f"📡 Enviando audio en {total_audio_chunks} chunk(s)...")
-            
-            for i, chunk in enumerate(audio_chunks):
-                payload = {
-                    "chunk_id": i,
-                    "total_chunks": total_audio_chunks,
-                    "data": chunk,
-                    "timestamp": metadata["timestamp"]
-                }
-                
-                mqtt_client.publish(
-                    MQTT_TOPIC_AUDIO,
-                    json.dumps(payload),
-                    qos=1
-                )
-                
-                print(f"  Chunk {i+1}/{total_audio_chunks} enviado")
-                time.sleep(0.1)
+        if audio_path:
+            mime_audio = f"audio/{os.path.splitext(audio_path)[1].lstrip('.')}"
+            publicar_archivo(MQTT_TOPIC_AUDIO, audio_path, mime_audio, timestamp)
         
-        print(f"✅ Datos enviados por MQTT exitosamente")
+        log.info(f"✅ Datos enviados por MQTT exitosamente")
         return True
         
     except Exception as e:
-        print(f"✗ Error al enviar por MQTT: {e}")
+        log.error(f"✗ Error al enviar por MQTT: {e}")
         return False
     finally:
         # Limpiar archivos temporales
         try:
-            if foto_path and os.path.exists(foto_path):
+            # Las fotos del anillo se sobrescriben en la siguiente vuelta
+            es_slot = foto_path and os.path.basename(foto_path).startswith(PREFIJO_SLOT)
+            if foto_path and not es_slot and os.path.exists(foto_path):
                 os.remove(foto_path)
-                print(f"🗑️  Foto temporal eliminada")
+                log.info(f"🗑️  Foto temporal eliminada")
             if audio_path and os.path.exists(audio_path):
                 os.remove(audio_path)
-                print(f"🗑️  Audio temporal eliminado")
+                log.info(f"🗑️  Audio temporal eliminado")
             if video_path and os.path.exists(video_path):
                 os.remove(video_path)
-                print(f"🗑️  Video temporal eliminado")
+                log.info(f"🗑️  Video temporal eliminado")
+        except Exception as e:
+            log.warning(f"⚠️  Error al limpiar temporales: {e}")
+
+def enviar_foto(foto_path, timestamp=None, fin=None):
+    """Envía una sola foto por MQTT (sin audio ni video)"""
+    return enviar_por_mqtt(foto_path, None, None, timestamp, fin)
+
+def hilo_envio():
+    """Hilo que publica por MQTT las fotos que va dejando la captura"""
+    global errores_envio
+    
+    while True:
+        foto_path, timestamp, fin = cola_envio.get()
+        try:
+            log.info(f"\n📡 Enviando {os.path.basename(foto_path)}...")
+            if not enviar_foto(foto_path, timestamp, fin):
+                errores_envio += 1
+                log.warning(f"⚠️  Error enviando {os.path.basename(foto_path)}")
         except Exception as e:
-            print(f"⚠️  Error al limpiar temporales: {e}")
+            errores_envio += 1
+            log.error(f"✗ Error en hilo de envío: {e}")
+        finally:
+            cola_envio.task_done()
+
+def iniciar_hilo_envio():
+    """Arranca el hilo de envío (una sola vez por proceso)"""
+    thread = threading.Thread(target=hilo_envio, name="envio_mqtt")
+    thread.daemon = True
+    thread.start()
 
 def procesar_comando_captura():
     """
     Procesa el comando de captura automáticamente.
-    Captura una o varias fotos según configuración y las envía por MQTT.
+    Captura una o varias fotos según configuración y las encola para que
+    el hilo de envío las publique por MQTT mientras se toma la siguiente.
     """
-    print("\n" + "=" * 60)
-    print("🚨 COMANDO DE CAPTURA RECIBIDO VÍA MQTT")
-    print("=" * 60)
+    global errores_envio, hash_anterior, timestamp_anterior
+    log.info("\n" + "=" * 60)
+    log.info("🚨 COMANDO DE CAPTURA RECIBIDO VÍA MQTT")
+    log.info("=" * 60)
     
     try:
         fotos_paths = []
+        # Si la última captura falla, ninguna metadata lleva el cierre de la
+        # secuencia y se publica aparte al terminar
+        fin_en_metadata = False
+        errores_envio = 0
+        hash_anterior = None
+        timestamp_anterior = None
         
         # Capturar fotos según configuración
         if CAPTURAR_SECUENCIA:
             # Capturar secuencia de fotos
-            print(f"\n📸 Capturando secuencia de {NUMERO_FOTOS} fotos...")
-            print(f"   Intervalo: {INTERVALO_FOTOS} segundos entre fotos")
+            log.info(f"\n📸 Capturando secuencia de {NUMERO_FOTOS} fotos...")
+            log.info(f"   Intervalo: {INTERVALO_FOTOS} segundos entre fotos")
             
             for i in range(NUMERO_FOTOS):
-                print(f"\n📷 Foto {i+1}/{NUMERO_FOTOS}:")
+                log.info(f"\n📷 Foto {i+1}/{NUMERO_FOTOS}:")
+                ahora = datetime.now()
                 foto_path = capturar_foto()
                 
                 if foto_path:
                     fotos_paths.append(foto_path)
-                    print(f"✓ Foto {i+1} capturada")
+                    # La última foto lleva el cierre de la secuencia en su
+                    # metadata: no hace falta un status aparte al terminar
+                    fin = None
+                    if i == NUMERO_FOTOS - 1:
+                        fin = {"fin_secuencia": True, "cantidad_fotos": len(fotos_paths)}
+                        fin_en_metadata = True
+                    cola_envio.put((foto_path, ahora.isoformat(), fin))
+                    log.info(f"✓ Foto {i+1} capturada (en cola de envío)")
                 else:
-                    print(f"✗ Error en foto {i+1}")
+                    log.error(f"✗ Error en foto {i+1}")
                 
                 # Esperar antes de siguiente foto (excepto la última)
                 if i < NUMERO_FOTOS - 1:
-                    print(f"⏳ Esperando {INTERVALO_FOTOS} segundos...")
+                    log.info(f"⏳ Esperando {INTERVALO_FOTOS} segundos...")
                     time.sleep(INTERVALO_FOTOS)
             
-            print(f"\n✅ Secuencia completada: {len(fotos_paths)}/{NUMERO_FOTOS} fotos capturadas")
+            log.info(f"\n✅ Secuencia completada: {len(fotos_paths)}/{NUMERO_FOTOS} fotos capturadas")
         else:
             # Capturar solo una foto
-            print(f"\n📸 Capturando foto única...")
+            log.info(f"\n📸 Capturando foto única...")
+            ahora = datetime.now()
             foto_path = capturar_foto()
             if foto_path:
                 fotos_paths.append(foto_path)
+                cola_envio.put((foto_path, ahora.isoformat(),
+                                {"fin_secuencia": True, "cantidad_fotos": 1}))
+                fin_en_metadata = True
         
         # Verificar que tenemos al menos una foto
         if not fotos_paths:
-            print("✗ No se pudo capturar ninguna foto")
+            log.error("✗ No se pudo capturar ninguna foto")
             mqtt_client.publish(
                 MQTT_TOPIC_STATUS_CAMARA,
-                json.dumps({"status": "error", "mensaje": "Error al capturar fotos"}),
+                dumps({"status": "error", "mensaje": "Error al capturar fotos"}),
                 qos=1
             )
             return False
         
-        # Enviar todas las fotos por MQTT
-        print(f"\n📤 Enviando {len(fotos_paths)} foto(s) por MQTT...")
-        
-        exito_total = True
-        for i, foto_path in enumerate(fotos_paths, 1):
-            print(f"\n📡 Enviando foto {i}/{len(fotos_paths)}...")
-            exito = enviar_por_mqtt(foto_path, None, None)  # Solo foto, sin audio ni video
-            if not exito:
-                exito_total = False
-                print(f"⚠️  Error enviando foto {i}")
+        # Esperar a que el hilo de envío termine de publicar todas las fotos
+        log.info(f"\n📤 Esperando envío de {len(fotos_paths)} foto(s) por MQTT...")
+        cola_envio.join()
         
-        if exito_total:
-            print("\n✅ Todas las fotos enviadas exitosamente")
+        if not fin_en_metadata:
             mqtt_client.publish(
                 MQTT_TOPIC_STATUS_CAMARA,
-                json.dumps({
-                    "status": "success",
-                    "mensaje": f"{len(fotos_paths)} foto(s) capturada(s) y enviada(s)",
-                    "timestamp": datetime.now().isoformat(),
-                    "cantidad_fotos": len(fotos_paths)
+                dumps({
+                    "status": "fin_secuencia",
+                    "fin_secuencia": True,
+                    "cantidad_fotos": len(fotos_paths),
+                    "timestamp": datetime.now().isoformat()
                 }),
                 qos=1
             )
+        
+        # El éxito ya viaja en la metadata de la última foto; el status
+        # solo se publica si algo falló
+        if errores_envio == 0:
+            log.info("\n✅ Todas las fotos enviadas exitosamente")
             return True
         else:
-            print("\n⚠️  Algunas fotos no se pudieron enviar")
+            log.warning("\n⚠️  Algunas fotos no se pudieron enviar")
+            mqtt_client.publish(
+                MQTT_TOPIC_STATUS_CAMARA,
+                dumps({
+                    "status": "error",
+                    "mensaje": f"{errores_envio} de {len(fotos_paths)} foto(s) no se pudieron enviar",
+                    "timestamp": datetime.now().isoformat()
+                }),
+                qos=1
+            )
             return False
             
     except Exception as e:
-        print(f"\n✗ Error en proceso de captura: {e}")
+        log.error(f"\n✗ Error en proceso de captura: {e}")
+        mqtt_client.publish(
+            MQTT_TOPIC_STATUS_CAMARA,
+            dumps({"status": "error", "mensaje": str(e)}),
+            qos=1
+        )
+        return False
+
+def ejecutar_captura():
+    """Ejecuta la captura en el executor y libera el indicador al terminar"""
+    try:
+        procesar_comando_captura()
+    finally:
+        captura_en_curso.clear()
+
+def solicitar_captura():
+    """
+    Encola una captura si no hay otra en curso.
+    Retorna inmediatamente: on_message no debe bloquear el loop de paho.
+    """
+    if captura_en_curso.is_set():
+        log.info("   ⏳ Captura en curso, comando ignorado")
         mqtt_client.publish(
             MQTT_TOPIC_STATUS_CAMARA,
-            json.dumps({"status": "error", "mensaje": str(e)}),
+            dumps({
+                "status": "busy",
+                "mensaje": "Captura en curso",
+                "timestamp": datetime.now().isoformat()
+            }),
             qos=1
         )
         return False
 
+    captura_en_curso.set()
+    executor_captura.submit(ejecutar_captura)
+    return True
+
 # ============================================================================
 # CALLBACKS MQTT
 # ============================================================================
 
-def on_connect(client, userdata, flags, rc):
-    """Callback cuando se conecta al broker MQTT"""
+def on_connect(client, userdata, flags, rc, properties=None):
+    """Callback cuando se conecta al broker MQTT (firma MQTTv5)"""
     if rc == 0:
-        print(f"\n✓ Conectado al broker MQTT: {MQTT_BROKER}")
+        log.info(f"\n✓ Conectado al broker MQTT: {MQTT_BROKER}")
         
-        # Suscribirse al topic de comandos
-        client.subscribe(MQTT_TOPIC_COMANDO_CAMARA, qos=1)
-        print(f"✓ Suscrito a: {MQTT_TOPIC_COMANDO_CAMARA}")
+        # Con sesión persistente el broker ya conserva la suscripción
+        if flags.get("session present"):
+            log.info(f"✓ Sesión MQTT restaurada")
+        else:
+            client.subscribe(MQTT_TOPIC_COMANDO_CAMARA, qos=1)
+            log.info(f"✓ Suscrito a: {MQTT_TOPIC_COMANDO_CAMARA}")
         
         # Publicar estado inicial
         client.publish(
             MQTT_TOPIC_STATUS_CAMARA,
-            json.dumps({
+            dumps({
                 "status": "online",
                 "dispositivo": "camara_mqtt_android",
                 "timestamp": datetime.now().isoformat()
             }),
             qos=1
         )
-        print(f"✓ Estado publicado en: {MQTT_TOPIC_STATUS_CAMARA}")
-        print(f"\n🎥 Cámara lista. Esperando comandos...")
+        log.info(f"✓ Estado publicado en: {MQTT_TOPIC_STATUS_CAMARA}")
+        log.info(f"\n🎥 Cámara lista. Esperando comandos...")
         
     else:
-        print(f"✗ Error de conexión MQTT. Código: {rc}")
+        log.error(f"✗ Error de conexión MQTT. Código: {rc}")
 
-def on_disconnect(client, userdata, rc):
-    """Callback cuando se desconecta del broker"""
+def on_socket_open(client, userdata, sock):
+    """Desactiva Nagle en el socket MQTT para no retrasar mensajes pequeños"""
+    try:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    except (OSError, AttributeError):
+        pass
+
+def on_disconnect(client, userdata, rc, properties=None):
+    """Callback cuando se desconecta del broker (firma MQTTv5)"""
     if rc != 0:
-        print(f"\n⚠️  Desconexión inesperada del broker MQTT. Código: {rc}")
-        print("   Intentando reconectar...")
+        log.warning(f"\n⚠️  Desconexión inesperada del broker MQTT. Código: {rc}")
+        log.info("   Intentando reconectar...")
 
 def on_message(client, userdata, msg):
     """Callback cuando llega un mensaje MQTT"""
@@ -621,30 +961,27 @@ def on_message(client, userdata, msg):
         topic = msg.topic
         payload = msg.payload.decode('utf-8')
         
-        print(f"\n📩 Mensaje MQTT recibido:")
-        print(f"   Topic: {topic}")
-        print(f"   Payload: {payload[:100]}")
+        log.info(f"\n📩 Mensaje MQTT recibido:")
+        log.info(f"   Topic: {topic}")
+        log.info(f"   Payload: {payload[:100]}")
         
         if topic == MQTT_TOPIC_COMANDO_CAMARA:
             # Parsear comando
             try:
-                comando = json.loads(payload)
+                comando = loads(payload)
                 accion = comando.get("accion", "")
                 
                 if accion == "CAPTURAR":
-                    print(f"   Acción: CAPTURAR")
-                    # Procesar captura en un hilo separado para no bloquear
-                    import threading
-                    thread = threading.Thread(target=procesar_comando_captura)
-                    thread.daemon = True
-                    thread.start()
+                    log.info(f"   Acción: CAPTURAR")
+                    # Procesar captura fuera del hilo de paho para no bloquear
+                    solicitar_captura()
                     
                 elif accion == "PING":
-                    print(f"   Acción: PING")
+                    log.info(f"   Acción: PING")
                     # Responder con pong
                     mqtt_client.publish(
                         MQTT_TOPIC_STATUS_CAMARA,
-                        json.dumps({
+                        dumps({
                             "status": "pong",
                             "timestamp": datetime.now().isoformat()
                         }),
@@ -654,74 +991,114 @@ def on_message(client, userdata, msg):
             except json.JSONDecodeError:
                 # Si no es JSON, asumir comando simple
                 if payload.upper() == "CAPTURAR":
-                    import threading
-                    thread = threading.Thread(target=procesar_comando_captura)
-                    thread.daemon = True
-                    thread.start()
+                    solicitar_captura()
             
     except Exception as e:
-        print(f"✗ Error procesando mensaje MQTT: {e}")
+        log.error(f"✗ Error procesando mensaje MQTT: {e}")
 
 # ============================================================================
 # MAIN
 # ============================================================================
 
+def obtener_client_id():
+    """
+    Retorna un client_id estable para este teléfono.
+    Se genera una vez y se guarda en CLIENT_ID_PATH, así el broker reconoce
+    la misma sesión en cada reconexión o reinicio del script.
+    """
+    try:
+        with open(CLIENT_ID_PATH) as f:
+            client_id = f.read().strip()
+            if client_id:
+                return client_id
+    except OSError:
+        pass
+
+    client_id = f"unsa_camera_{uuid.uuid4().hex[:12]}"
+    try:
+        with open(CLIENT_ID_PATH, 'w') as f:
+            f.write(client_id)
+    except OSError as e:
+        log.warning(f"⚠️  No se pudo guardar el client_id: {e}")
+    return client_id
+
 def inicializar_mqtt():
     """Inicializa la conexión MQTT"""
     global mqtt_client
     
     try:
         # Crear cliente MQTT
-        client_id = f"unsa_camera_{datetime.now().strftime('%Y%m%d%H%M%S')}"
-        mqtt_client = mqtt.Client(client_id=client_id)
+        client_id = obtener_client_id()
+        mqtt_client = mqtt.Client(
+            client_id=client_id,
+            protocol=mqtt.MQTTv5,
+            transport="tcp"
+        )
+        
+        # Ventana de mensajes en vuelo amplia: los chunks no esperan PUBACK
+        # uno por uno, y la cola local no tiene límite
+        mqtt_client.max_inflight_messages_set(MQTT_MAX_INFLIGHT)
+        mqtt_client.max_queued_messages_set(0)
         
         # Configurar callbacks
         mqtt_client.on_connect = on_connect
         mqtt_client.on_disconnect = on_disconnect
         mqtt_client.on_message = on_message
+        mqtt_client.on_socket_open = on_socket_open
         
         # Conectar al broker
-        print(f"🔌 Conectando a MQTT broker: {MQTT_BROKER}:{MQTT_PORT}...")
-        mqtt_client.connect(MQTT_BROKER, MQTT_PORT, MQTT_KEEPALIVE)
+        log.info(f"🔌 Conectando a MQTT broker: {MQTT_BROKER}:{MQTT_PORT}...")
+        propiedades = Properties(PacketTypes.CONNECT)
+        propiedades.SessionExpiryInterval = MQTT_SESSION_EXPIRY
+        mqtt_client.connect(
+            MQTT_BROKER,
+            MQTT_PORT,
+            MQTT_KEEPALIVE,
+            clean_start=False,
+            properties=propiedades
+        )
+        
+        # El loop de red corre en el hilo principal (ver __main__)
         
-        # Iniciar loop
-        mqtt_client.loop_start()
+        # Iniciar hilo de envío de fotos
+        iniciar_hilo_envio()
         
         return True
         
     except Exception as e:
-        print(f"✗ Error al inicializar MQTT: {e}")
+        log.error(f"✗ Error al inicializar MQTT: {e}")
         return False
 
 if __name__ == '__main__':
-    print("\n🚀 Iniciando cámara automática con MQTT...")
-    print(f"📱 Asegúrate de que Termux:API tenga permisos de cámara y micrófono")
-    print(f"💡 Para detener: Ctrl+C\n")
+    log.info("\n🚀 Iniciando cámara automática con MQTT...")
+    log.info(f"📱 Asegúrate de que Termux:API tenga permisos de cámara y micrófono")
+    log.info(f"💡 Para detener: Ctrl+C\n")
     
     if inicializar_mqtt():
-        print("\n✅ Sistema iniciado correctamente")
-        print("=" * 60 + "\n")
+        log.info("\n✅ Sistema iniciado correctamente")
+        log.info("=" * 60 + "\n")
         
         try:
-            # Mantener el programa corriendo
-            while True:
-                time.sleep(1)
+            # El hilo principal atiende la red MQTT: no hace falta un hilo
+            # extra de paho ni un bucle con sleep para mantener vivo el script
+            mqtt_client.loop_forever(retry_first_connection=True)
         except KeyboardInterrupt:
-            print("\n\n⏹️  Deteniendo cámara...")
+            log.info("\n\n⏹️  Deteniendo cámara...")
             
             # Publicar estado offline
             if mqtt_client:
                 mqtt_client.publish(
                     MQTT_TOPIC_STATUS_CAMARA,
-                    json.dumps({
+                    dumps({
                         "status": "offline",
                         "timestamp": datetime.now().isoformat()
                     }),
                     qos=1
                 )
-                mqtt_client.loop_stop()
                 mqtt_client.disconnect()
+                # Vaciar la cola de salida (estado offline + DISCONNECT)
+                mqtt_client.loop_forever()
             
-            print("✓ Cámara detenida")
+            log.info("✓ Cámara detenida")
     else:
-        print("\n✗ No se pudo inicializar el sistema MQTT")
+        log.error("\n✗ No se pudo inicializar el sistema MQTT")
@@ -10,7 +10,7 @@ INSTALACIÓN EN TERMUX:
 1. Instalar Termux desde F-Droid
 2. pkg update && pkg upgrade
 3. pkg install python termux-api
-4. pip install flask requests pillow
+4. pip install flask requests pillow waitress
 5. Dar permisos de cámara y micrófono a Termux:API
 
 EJECUCIÓN:
@@ -21,9 +21,28 @@ from flask import Flask, request, jsonify
 import subprocess
 import os
 import time
+import queue
+import threading
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from datetime import datetime
-import base64
+import gzip
+
+# orjson es opcional: respuestas JSON de Flask más rápidas
+try:
+    import orjson
+    from flask.json.provider import JSONProvider
+
+    class OrjsonProvider(JSONProvider):
+        """Proveedor JSON de Flask basado en orjson"""
+        def dumps(self, obj, **kwargs):
+            return orjson.dumps(obj).decode('utf-8')
+
+        def loads(self, s, **kwargs):
+            return orjson.loads(s)
+except ImportError:
+    OrjsonProvider = None
 
 # ============================================================================
 # CONFIGURACIÓN
@@ -32,17 +51,49 @@ import base64
 # IP del servidor principal (tu PC con el servidor FastAPI)
 SERVIDOR_PRINCIPAL = "http://10.166.236.39:5000"  # Cambiar a la IP actual
 
+# Comprimir el cuerpo de la subida con gzip (nivel 1: barato en CPU/batería).
+# Solo se aplica si la subida lleva audio WAV sin comprimir: el JPEG y el
+# audio .m4a (AAC) que graba este cliente ya están comprimidos y gzip apenas
+# los reduce, a costa de CPU y de recopiar todo el cuerpo en memoria
+COMPRIMIR_SUBIDA = True
+NIVEL_GZIP = 1
+
 # Puerto donde correrá este servidor en el teléfono
 PUERTO_CAMARA = 8080
 
-# Directorio para archivos temporales
-TEMP_DIR = "/data/data/com.termux/files/home/fire_detection_temp"
+# Directorio para archivos temporales: por defecto el tmp de Termux ($TMPDIR,
+# usr/tmp) en lugar de home, para no leer y escribir cada captura en la flash
+# del almacenamiento persistente. Se puede forzar con FIRE_DETECTION_TEMP_DIR
+TEMP_DIR = os.environ.get("FIRE_DETECTION_TEMP_DIR") or os.path.join(
+    os.environ.get("TMPDIR", "/data/data/com.termux/files/usr/tmp"),
+    "fire_detection"
+)
 
 # ============================================================================
 # INICIALIZACIÓN
 # ============================================================================
 
 app = Flask(__name__)
+if OrjsonProvider is not None:
+    app.json = OrjsonProvider(app)
+
+# Sesión HTTP persistente hacia el servidor principal: reutiliza la conexión
+# TCP (keep-alive) entre subidas y reintenta fallos de conexión
+sesion_http = requests.Session()
+sesion_http.mount("http://", HTTPAdapter(
+    pool_connections=4,
+    pool_maxsize=4,
+    max_retries=Retry(total=3, backoff_factor=0.3)
+))
+sesion_http.mount("https://", HTTPAdapter(
+    pool_connections=4,
+    pool_maxsize=4,
+    max_retries=Retry(total=3, backoff_factor=0.3)
+))
+
+# Cola de subidas pendientes: /capturar responde en cuanto termina la captura
+# y un hilo aparte sube al servidor, así la cámara se rearma sin esperar la red
+cola_subida = queue.Queue(maxsize=8)
 
 # Crear directorio temporal si no existe
 os.makedirs(TEMP_DIR, exist_ok=True)
@@ -58,13 +109,14 @@ print()
 # FUNCIONES DE CAPTURA
 # ============================================================================
 
-def capturar_foto():
+def capturar_foto(ts=None):
     """
     Captura una foto usando termux-camera-photo
+    `ts` es el sello "%Y%m%d_%H%M%S" de la captura (por defecto, ahora)
     Retorna la ruta del archivo o None si falla
     """
     try:
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        timestamp = ts or datetime.now().strftime("%Y%m%d_%H%M%S")
         foto_path = os.path.join(TEMP_DIR, f"captura_{timestamp}.jpg")
         
         print(f"📸 Capturando foto...")
@@ -73,7 +125,9 @@ def capturar_foto():
         # termux-camera-photo -c 0 archivo.jpg
         result = subprocess.run(
             ["termux-camera-photo", "-c", "0", foto_path],
-            capture_output=True,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,  # Solo stderr: se muestra si falla
             text=True,
             timeout=10
         )
@@ -90,80 +144,127 @@ def capturar_foto():
         print(f"✗ Excepción al capturar foto: {e}")
         return None
 
-def grabar_audio(duracion=5):
+# Margen tras la duración pedida para que termux cierre el archivo de audio
+MARGEN_GRABACION = 2
+
+def iniciar_grabacion_audio(duracion=5, ts=None):
     """
-    Graba audio durante X segundos usando termux-microphone-record
-    Retorna la ruta del archivo o None si falla
+    Lanza termux-microphone-record sin esperar a que termine.
+    `ts` es el sello "%Y%m%d_%H%M%S" de la captura (por defecto, ahora)
+    Retorna (proceso, ruta, inicio) o (None, None, None) si no se pudo
+    iniciar; `inicio` es el instante (time.monotonic) del lanzamiento
     """
     try:
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        timestamp = ts or datetime.now().strftime("%Y%m%d_%H%M%S")
         audio_path = os.path.join(TEMP_DIR, f"audio_{timestamp}.m4a")
         
         print(f"🎤 Grabando audio ({duracion} segundos)...")
         
-        # Iniciar grabación
-        subprocess.run(
+        inicio = time.monotonic()
+        proc = subprocess.Popen(
             ["termux-microphone-record", "-f", audio_path, "-l", str(duracion)],
-            capture_output=True,
-            timeout=duracion + 2
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL
         )
+        return proc, audio_path, inicio
         
-        if os.path.exists(audio_path):
-            size = os.path.getsize(audio_path)
-            print(f"✓ Audio grabado: {audio_path} ({size} bytes)")
-            return audio_path
-        else:
-            print(f"✗ No se pudo crear el archivo de audio")
-            return None
-            
     except Exception as e:
         print(f"✗ Excepción al grabar audio: {e}")
-        return None
+        return None, None, None
 
-def convertir_a_base64(filepath):
-    """Convierte un archivo a base64"""
+def esperar_grabacion_audio(proc, audio_path, duracion=5, inicio=None):
+    """
+    Espera a que termine una grabación iniciada con iniciar_grabacion_audio.
+    termux-microphone-record es ASÍNCRONO: el comando retorna enseguida y
+    la grabación sigue en segundo plano, así que además de esperar al
+    proceso se espera a que pasen `duracion` + MARGEN_GRABACION segundos
+    desde `inicio`.
+    Retorna la ruta del archivo o None si falla
+    """
+    if proc is None:
+        return None
+    
     try:
-        with open(filepath, 'rb') as f:
-            return base64.b64encode(f.read()).decode('utf-8')
-    except Exception as e:
-        print(f"✗ Error al convertir a base64: {e}")
+        proc.wait(timeout=duracion + MARGEN_GRABACION)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+        proc.wait()
+    
+    # Dormir solo lo que falte: la foto se tomó mientras se grababa
+    if inicio is not None:
+        restante = inicio + duracion + MARGEN_GRABACION - time.monotonic()
+        if restante > 0:
+            time.sleep(restante)
+    
+    if os.path.exists(audio_path):
+        size = os.path.getsize(audio_path)
+        print(f"✓ Audio grabado: {audio_path} ({size} bytes)")
+        return audio_path
+    else:
+        print(f"✗ No se pudo crear el archivo de audio")
         return None
 
-def subir_al_servidor(foto_path, audio_path):
+def grabar_audio(duracion=5):
+    """
+    Graba audio durante X segundos usando termux-microphone-record
+    Retorna la ruta del archivo o None si falla
+    """
+    proc, audio_path, inicio = iniciar_grabacion_audio(duracion)
+    return esperar_grabacion_audio(proc, audio_path, duracion, inicio)
+
+def subir_al_servidor(foto_path, audio_path, timestamp=None):
     """
-    Sube la foto y audio al servidor principal
+    Sube la foto y audio al servidor principal como multipart/form-data.
+    Los archivos viajan en binario (sin base64); prepare_request arma el
+    cuerpo completo en memoria (y gzip, si se aplica, lo recomprime entero)
+    antes de enviarlo.
+    `timestamp` (ISO) es el momento de la captura; por defecto, el del envío.
     """
+    archivos_abiertos = []
     try:
         print(f"\n📤 Preparando envío al servidor...")
         
-        # Convertir a base64
-        foto_base64 = convertir_a_base64(foto_path) if foto_path else None
-        audio_base64 = convertir_a_base64(audio_path) if audio_path else None
-        
-        if not foto_base64:
-            print("✗ No se pudo convertir la foto")
+        if not foto_path:
+            print("✗ No hay foto para enviar")
             return False
         
-        # Preparar datos
+        foto_file = open(foto_path, 'rb')
+        archivos_abiertos.append(foto_file)
+        archivos = {
+            "imagen": (os.path.basename(foto_path), foto_file, "image/jpeg")
+        }
+        if audio_path:
+            audio_file = open(audio_path, 'rb')
+            archivos_abiertos.append(audio_file)
+            archivos["audio"] = (os.path.basename(audio_path), audio_file, "audio/mp4")
+        
+        # Campos de texto del formulario
         datos = {
-            "imagen": foto_base64,
-            "audio": audio_base64,
-            "timestamp": datetime.now().isoformat(),
+            "timestamp": timestamp or datetime.now().isoformat(),
             "dispositivo": "camara_android"
         }
         
         # Enviar al servidor
-        print(f"📡 Enviando datos al servidor {SERVIDOR_PRINCIPAL}/api/upload...")
-        response = requests.post(
-            f"{SERVIDOR_PRINCIPAL}/api/upload",
-            json=datos,
-            timeout=30
-        )
+        print(f"📡 Enviando datos al servidor {SERVIDOR_PRINCIPAL}/api/upload/archivos...")
+        peticion = sesion_http.prepare_request(requests.Request(
+            "POST",
+            f"{SERVIDOR_PRINCIPAL}/api/upload/archivos",
+            files=archivos,
+            data=datos
+        ))
+        
+        if COMPRIMIR_SUBIDA and audio_path and audio_path.endswith(".wav"):
+            peticion.body = gzip.compress(peticion.body, compresslevel=NIVEL_GZIP)
+            peticion.headers["Content-Encoding"] = "gzip"
+            peticion.headers["Content-Length"] = str(len(peticion.body))
+        
+        response = sesion_http.send(peticion, timeout=30)
         
         if response.status_code == 200:
             result = response.json()
             print(f"✓ Datos enviados correctamente")
-            print(f"   Análisis IA: {result.get('analisis', {})}")
+            print(f"   Análisis IA: {result.get('status')} ({result.get('confianza')})")
             return True
         else:
             print(f"✗ Error del servidor: {response.status_code}")
@@ -174,6 +275,10 @@ def subir_al_servidor(foto_path, audio_path):
         print(f"✗ Error al subir datos: {e}")
         return False
     finally:
+        # Cerrar los archivos antes de borrarlos
+        for archivo in archivos_abiertos:
+            archivo.close()
+        
         # Limpiar archivos temporales
         try:
             if foto_path and os.path.exists(foto_path):
@@ -185,6 +290,22 @@ def subir_al_servidor(foto_path, audio_path):
         except Exception as e:
             print(f"⚠️  Error al limpiar temporales: {e}")
 
+def hilo_subida():
+    """Hilo que sube al servidor las capturas encoladas por /capturar"""
+    while True:
+        foto_path, audio_path, timestamp = cola_subida.get()
+        try:
+            if subir_al_servidor(foto_path, audio_path, timestamp):
+                print("\n✅ Captura subida al servidor")
+            else:
+                print("\n⚠️  No se pudo subir la captura")
+        except Exception as e:
+            print(f"✗ Error en hilo de subida: {e}")
+        finally:
+            cola_subida.task_done()
+
+threading.Thread(target=hilo_subida, name="subida", daemon=True).start()
+
 # ============================================================================
 # ENDPOINTS HTTP
 # ============================================================================
@@ -202,7 +323,7 @@ def health_check():
 def capturar_multimedia():
     """
     Endpoint que recibe comando de captura desde el servidor principal.
-    Automáticamente captura foto + audio y los sube al servidor.
+    Captura foto + audio, encola la subida al servidor y responde 202.
     """
     try:
         print("\n" + "=" * 60)
@@ -215,11 +336,16 @@ def capturar_multimedia():
         
         print(f"⚙️  Duración de audio: {duracion_audio} segundos")
         
-        # 1. Capturar foto
-        foto_path = capturar_foto()
+        # Una sola muestra de tiempo para nombres de archivo, subida y respuesta
+        ahora = datetime.now()
+        ts_str = ahora.strftime("%Y%m%d_%H%M%S")
+        ts_iso = ahora.isoformat()
         
-        # 2. Grabar audio
-        audio_path = grabar_audio(duracion=duracion_audio)
+        # 1-2. Lanzar la grabación de audio y capturar la foto mientras
+        # el micrófono sigue grabando
+        proc_audio, audio_path, inicio_audio = iniciar_grabacion_audio(duracion_audio, ts_str)
+        foto_path = capturar_foto(ts_str)
+        audio_path = esperar_grabacion_audio(proc_audio, audio_path, duracion_audio, inicio_audio)
         
         # 3. Verificar que al menos tenemos foto
         if not foto_path:
@@ -228,22 +354,25 @@ def capturar_multimedia():
                 "error": "No se pudo capturar la foto"
             }), 500
         
-        # 4. Subir al servidor principal
-        exito = subir_al_servidor(foto_path, audio_path)
-        
-        if exito:
-            print("\n✅ Proceso completado exitosamente")
-            return jsonify({
-                "success": True,
-                "mensaje": "Foto y audio capturados y enviados correctamente",
-                "timestamp": datetime.now().isoformat()
-            })
-        else:
-            print("\n⚠️  Proceso completado con errores")
+        # 4. Encolar la subida y responder sin esperar al servidor
+        try:
+            cola_subida.put_nowait((foto_path, audio_path, ts_iso))
+        except queue.Full:
+            print("\n⚠️  Cola de subida llena, se descarta la captura")
+            for path in (foto_path, audio_path):
+                if path and os.path.exists(path):
+                    os.remove(path)
             return jsonify({
                 "success": False,
-                "error": "Error al subir datos al servidor"
-            }), 500
+                "error": "Cola de subida llena"
+            }), 503
+        
+        print(f"\n✅ Captura lista, subida en cola ({cola_subida.qsize()} pendiente(s))")
+        return jsonify({
+            "success": True,
+            "mensaje": "Foto y audio capturados; el envío al servidor está en curso",
+            "timestamp": ts_iso
+        }), 202
             
     except Exception as e:
         print(f"\n✗ Error en proceso de captura: {e}")
@@ -258,11 +387,10 @@ def test_captura():
     try:
         print("\n🧪 TEST DE CAPTURA")
         
-        # Capturar foto
+        # Capturar foto mientras se graba el audio
+        proc_audio, audio_path, inicio_audio = iniciar_grabacion_audio(3)
         foto_path = capturar_foto()
-        
-        # Grabar audio
-        audio_path = grabar_audio(duracion=3)
+        audio_path = esperar_grabacion_audio(proc_audio, audio_path, 3, inicio_audio)
         
         resultado = {
             "foto_capturada": foto_path is not None,
@@ -290,10 +418,23 @@ if __name__ == '__main__':
     print(f"💡 Para detener el servidor: Ctrl+C")
     print("\n" + "=" * 60 + "\n")
     
-    # Iniciar servidor Flask
-    app.run(
-        host='0.0.0.0',  # Escuchar en todas las interfaces
-        port=PUERTO_CAMARA,
-        debug=False,
-        threaded=True
-    )
+    # Iniciar servidor: waitress si está instalado, si no el servidor de
+    # desarrollo de Flask
+    try:
+        from waitress import serve
+    except ImportError:
+        print("⚠️  waitress no instalado, usando el servidor de desarrollo de Flask")
+        app.run(
+            host='0.0.0.0',  # Escuchar en todas las interfaces
+            port=PUERTO_CAMARA,
+            debug=False,
+            threaded=True
+        )
+    else:
+        serve(
+            app,
+            host='0.0.0.0',  # Escuchar en todas las interfaces
+            port=PUERTO_CAMARA,
+            threads=4,
+            connection_limit=32
+        )
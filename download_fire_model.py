@@ -6,6 +6,7 @@ Intenta varias fuentes públicas hasta encontrar una que funcione.
 
 import urllib.request
 import os
+import shutil
 import sys
 
 # Directorio donde guardar el modelo
@@ -40,13 +41,18 @@ def download_file(url, dest_path):
         )
         
         with urllib.request.urlopen(req, timeout=30) as response:
-            data = response.read()
+            # Leer solo la cabecera para descartar páginas HTML antes de
+            # descargar el resto del archivo
+            head = response.read(16)
             
             # Verificar que es un archivo TFLite (empieza con "TFL3" o similar)
-            if len(data) > 0 and not data[:15].decode('utf-8', errors='ignore').startswith('<!DOCTYPE'):
+            if len(head) > 0 and not head.decode('utf-8', errors='ignore').startswith('<!DOCTYPE'):
+                # Copiar el resto a disco por bloques, sin cargarlo en memoria
                 with open(dest_path, 'wb') as f:
-                    f.write(data)
-                print(f"✅ Descargado: {len(data)} bytes")
+                    f.write(head)
+                    shutil.copyfileobj(response, f, 64 * 1024)
+                    size = f.tell()
+                print(f"✅ Descargado: {size} bytes")
                 return True
             else:
                 print("⚠️  El archivo parece ser HTML, no un modelo TFLite")
@@ -7,6 +7,7 @@ import os
 import sys
 from pathlib import Path
 import json
+from concurrent.futures import ThreadPoolExecutor
 
 # Instalación de dependencias necesarias:
 # pip install ultralytics opencv-python pillow torch torchvision
@@ -16,6 +17,12 @@ def install_dependencies():
     print("Instalando dependencias...")
     os.system("pip install ultralytics opencv-python pillow torch torchvision")
 
+# Extensiones de imagen aceptadas (se comparan en minúsculas)
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png'}
+
+# Imágenes por lote en la inferencia YOLO de detect_fire_in_images
+YOLO_BATCH_SIZE = 16
+
 def download_fire_model():
     """
     Descarga un modelo YOLOv8 pre-entrenado para detección de incendios
@@ -33,37 +40,48 @@ def download_fire_model():
     
     return model
 
-def analyze_image_colors(image_path):
+# Ancho al que se reduce la imagen antes del análisis de color. El
+# porcentaje de área no depende de la escala, pero focos de fuego muy
+# pequeños pueden perderse si este valor es demasiado bajo
+COLOR_ANALYSIS_WIDTH = 320
+
+# Umbral mínimo del canal rojo para considerar un píxel como fuego
+FIRE_RED_MIN = 180
+
+# Margen mínimo de R sobre G: aproxima la saturación y descarta tonos
+# casi blancos, beige o de piel (p. ej. 230/225/220) que cumplen R > G > B
+FIRE_RG_MARGIN = 20
+
+def analyze_image_colors(image_path, max_width=COLOR_ANALYSIS_WIDTH):
     """
     Análisis complementario basado en colores
     Detecta patrones de color rojo/naranja/amarillo
+    La imagen se reduce a `max_width` píxeles de ancho (None = sin reducir)
     """
     import cv2
-    import numpy as np
     
     img = cv2.imread(str(image_path))
     if img is None:
         return {"fire_detected": False, "confidence": 0}
     
-    # Convertir a HSV para mejor detección de colores
-    hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
-    
-    # Rangos de color para fuego
-    # Rojo (fuego intenso)
-    lower_red1 = np.array([0, 100, 100])
-    upper_red1 = np.array([10, 255, 255])
-    lower_red2 = np.array([160, 100, 100])
-    upper_red2 = np.array([180, 255, 255])
-    
-    # Naranja-Amarillo (llamas)
-    lower_orange = np.array([10, 100, 100])
-    upper_orange = np.array([30, 255, 255])
-    
-    mask_red1 = cv2.inRange(hsv, lower_red1, upper_red1)
-    mask_red2 = cv2.inRange(hsv, lower_red2, upper_red2)
-    mask_orange = cv2.inRange(hsv, lower_orange, upper_orange)
-    
-    mask_fire = mask_red1 | mask_red2 | mask_orange
+    # Reducir antes de analizar: el porcentaje de fuego se conserva con
+    # muchos menos píxeles que recorrer
+    h, w = img.shape[:2]
+    if max_width and w > max_width:
+        img = cv2.resize(img, (max_width, max(1, int(max_width * h / w))),
+                         interpolation=cv2.INTER_AREA)
+    
+    # Criterio de color de fuego directamente sobre BGR, sin convertir a HSV:
+    # rojo intenso (R > FIRE_RED_MIN), R > G + FIRE_RG_MARGIN y G > B (rojo,
+    # naranja y amarillo saturados). cv2.subtract satura en 0, así R - G se
+    # queda en uint8; compare y bitwise_and usan SIMD (NEON/SSE) y las
+    # máscaras se combinan en el mismo buffer (dst=) sin crear nuevas
+    b, g, r = cv2.split(img)
+    mask_fire = cv2.compare(r, FIRE_RED_MIN, cv2.CMP_GT)
+    mask_tmp = cv2.compare(cv2.subtract(r, g), FIRE_RG_MARGIN, cv2.CMP_GT)
+    cv2.bitwise_and(mask_fire, mask_tmp, dst=mask_fire)
+    cv2.compare(g, b, cv2.CMP_GT, dst=mask_tmp)
+    cv2.bitwise_and(mask_fire, mask_tmp, dst=mask_fire)
     
     # Calcular porcentaje de píxeles de fuego
     total_pixels = img.shape[0] * img.shape[1]
@@ -80,6 +98,36 @@ def analyze_image_colors(image_path):
         "fire_percentage": round(fire_percentage, 2)
     }
 
+def summarize_yolo_results(model, results):
+    """Resume las detecciones YOLO de una imagen en objetos y confianza máxima"""
+    # En un modelo real de incendios, buscarías clases como:
+    # 'fire', 'smoke', 'flames'
+    # Por ahora, con el modelo base buscamos objetos relacionados
+    
+    fire_related_classes = []
+    max_confidence = 0
+    
+    for result in results:
+        if result.boxes is not None:
+            for box in result.boxes:
+                conf = float(box.conf[0])
+                cls = int(box.cls[0])
+                class_name = model.names[cls]
+                
+                # Registrar objetos detectados
+                if conf > max_confidence:
+                    max_confidence = conf
+                
+                fire_related_classes.append({
+                    "class": class_name,
+                    "confidence": round(conf * 100, 2)
+                })
+    
+    return {
+        "objects_detected": fire_related_classes,
+        "max_confidence": round(max_confidence * 100, 2)
+    }
+
 def analyze_with_yolo(model, image_path):
     """
     Analiza una imagen usando YOLOv8
@@ -93,33 +141,7 @@ def analyze_with_yolo(model, image_path):
             verbose=False
         )
         
-        # En un modelo real de incendios, buscarías clases como:
-        # 'fire', 'smoke', 'flames'
-        # Por ahora, con el modelo base buscamos objetos relacionados
-        
-        fire_related_classes = []
-        max_confidence = 0
-        
-        for result in results:
-            if result.boxes is not None:
-                for box in result.boxes:
-                    conf = float(box.conf[0])
-                    cls = int(box.cls[0])
-                    class_name = model.names[cls]
-                    
-                    # Registrar objetos detectados
-                    if conf > max_confidence:
-                        max_confidence = conf
-                    
-                    fire_related_classes.append({
-                        "class": class_name,
-                        "confidence": round(conf * 100, 2)
-                    })
-        
-        return {
-            "objects_detected": fire_related_classes,
-            "max_confidence": round(max_confidence * 100, 2)
-        }
+        return summarize_yolo_results(model, results)
     
     except Exception as e:
         print(f"Error en análisis YOLO: {e}")
@@ -138,10 +160,12 @@ def detect_fire_in_images(images_folder, model=None):
             "error": f"Carpeta {images_folder} no existe"
         }
     
-    # Obtener todas las imágenes
-    image_files = []
-    for ext in ['*.jpg', '*.jpeg', '*.png', '*.JPG', '*.JPEG', '*.PNG']:
-        image_files.extend(images_path.glob(ext))
+    # Obtener todas las imágenes en una sola pasada por el directorio
+    image_files = [
+        Path(entry.path)
+        for entry in os.scandir(images_path)
+        if entry.is_file() and os.path.splitext(entry.name)[1].lower() in IMAGE_EXTENSIONS
+    ]
     
     if len(image_files) == 0:
         return {
@@ -159,36 +183,60 @@ def detect_fire_in_images(images_folder, model=None):
         "details": []
     }
     
-    for img_path in image_files:
-        print(f"\n📸 Analizando: {img_path.name}")
+    # Análisis por colores (más confiable para esta demo) en hilos: OpenCV
+    # libera el GIL, así corre en paralelo con el lote de YOLO
+    with ThreadPoolExecutor(max_workers=os.cpu_count() or 2) as executor:
+        color_futures = [executor.submit(analyze_image_colors, p) for p in image_files]
         
-        # Análisis por colores (más confiable para esta demo)
-        color_analysis = analyze_image_colors(img_path)
-        
-        # Análisis con YOLO (opcional, comentado por ahora)
-        yolo_analysis = {"objects_detected": [], "max_confidence": 0}
+        # Análisis con YOLO (opcional): todas las imágenes en una sola llamada
+        # por lotes en lugar de un predict por archivo
+        yolo_results = None
         if model is not None:
-            yolo_analysis = analyze_with_yolo(model, img_path)
-        
-        # Decisión final combinando ambos métodos
-        fire_detected = color_analysis["fire_detected"]
-        confidence = color_analysis["confidence"]
-        
-        image_result = {
-            "filename": img_path.name,
-            "fire_detected": fire_detected,
-            "confidence": confidence,
-            "color_analysis": color_analysis,
-            "yolo_analysis": yolo_analysis
-        }
-        
-        results["details"].append(image_result)
+            yolo_results = iter(model.predict(
+                source=[str(p) for p in image_files],
+                conf=0.25,  # Confianza mínima
+                batch=YOLO_BATCH_SIZE,
+                stream=True,
+                verbose=False
+            ))
         
-        if fire_detected:
-            results["images_with_fire"].append(img_path.name)
-            print(f"  🔥 FUEGO DETECTADO - Confianza: {confidence}%")
-        else:
-            print(f"  ✓ Sin incendio detectado")
+        for img_path, color_future in zip(image_files, color_futures):
+            print(f"\n📸 Analizando: {img_path.name}")
+            
+            color_analysis = color_future.result()
+            
+            yolo_analysis = {"objects_detected": [], "max_confidence": 0}
+            if yolo_results is not None:
+                try:
+                    yolo_analysis = summarize_yolo_results(model, [next(yolo_results)])
+                except Exception as e:
+                    # Un archivo ilegible corta el generador del lote: esta
+                    # imagen y las siguientes se analizan de a una, y
+                    # analyze_with_yolo aísla el error de cada archivo
+                    print(f"Error en análisis YOLO por lotes: {e}")
+                    yolo_results = None
+            if yolo_results is None and model is not None:
+                yolo_analysis = analyze_with_yolo(model, img_path)
+            
+            # Decisión final combinando ambos métodos
+            fire_detected = color_analysis["fire_detected"]
+            confidence = color_analysis["confidence"]
+            
+            image_result = {
+                "filename": img_path.name,
+                "fire_detected": fire_detected,
+                "confidence": confidence,
+                "color_analysis": color_analysis,
+                "yolo_analysis": yolo_analysis
+            }
+            
+            results["details"].append(image_result)
+            
+            if fire_detected:
+                results["images_with_fire"].append(img_path.name)
+                print(f"  🔥 FUEGO DETECTADO - Confianza: {confidence}%")
+            else:
+                print(f"  ✓ Sin incendio detectado")
     
     # Si al menos una imagen tiene fuego, activar alerta
     results["fire_detected"] = len(results["images_with_fire"]) > 0
@@ -7,9 +7,64 @@ y el servidor Python (red honor) usando HiveMQ como broker en la nube.
 """
 
 import json
+import sys
+import time
+import queue
+import socket
+import logging
+import threading
+from logging.handlers import QueueHandler, QueueListener
+import heapq
+import itertools
+from collections import OrderedDict
+import hashlib
+import zlib
 import paho.mqtt.client as mqtt
 from datetime import datetime
 
+# orjson es opcional: parsea y serializa más rápido que json y trabaja con
+# bytes. Sin él se usa json de la biblioteca estándar.
+try:
+    import orjson
+
+    def loads(data):
+        return orjson.loads(data)
+
+    def dumps(obj):
+        return orjson.dumps(obj)
+except ImportError:
+    def loads(data):
+        return json.loads(data)
+
+    def dumps(obj):
+        return json.dumps(obj)
+
+# Los callbacks MQTT no escriben en stdout: encolan el mensaje y un hilo
+# (QueueListener) lo imprime, así la escritura no frena la recepción.
+# Lo encolado antes de iniciar_logging() se imprime al arrancar el hilo
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+log.propagate = False
+COLA_LOG = queue.SimpleQueue()
+log.addHandler(QueueHandler(COLA_LOG))
+listener_log = None
+
+def iniciar_logging():
+    """Arranca el hilo que escribe en stdout los mensajes encolados"""
+    global listener_log
+    if listener_log is None:
+        handler = logging.StreamHandler(sys.stdout)
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        listener_log = QueueListener(COLA_LOG, handler)
+        listener_log.start()
+
+def detener_logging():
+    """Escribe lo pendiente y detiene el hilo de logging"""
+    global listener_log
+    if listener_log is not None:
+        listener_log.stop()
+        listener_log = None
+
 # ============================================================================
 # CONFIGURACIÓN HIVEMQ CLOUD (Broker público gratuito)
 # ============================================================================
@@ -28,12 +83,49 @@ MQTT_TOPIC_FOTO = "unsa/fire_detection/foto"
 MQTT_TOPIC_AUDIO = "unsa/fire_detection/audio"
 MQTT_TOPIC_STATUS_CAMARA = "unsa/fire_detection/status_camara"
 
+# Sub-topics del protocolo binario de la cámara:
+#   {topic}/metadata                     -> JSON con size, total_chunks, sha256, compresion...
+#   {topic}/chunk/{timestamp}/{chunk_id} -> bytes crudos del archivo
+MQTT_TOPIC_FOTO_METADATA = f"{MQTT_TOPIC_FOTO}/metadata"
+MQTT_TOPIC_FOTO_CHUNK = f"{MQTT_TOPIC_FOTO}/chunk/"
+MQTT_TOPIC_AUDIO_METADATA = f"{MQTT_TOPIC_AUDIO}/metadata"
+MQTT_TOPIC_AUDIO_CHUNK = f"{MQTT_TOPIC_AUDIO}/chunk/"
+
 # Cliente MQTT global
 mqtt_client = None
 
 # Variables para reconstruir foto/audio desde chunks
-foto_chunks_buffer = {}
-audio_chunks_buffer = {}
+# {timestamp: {"meta": dict o None, "chunks": dict, list o bytearray,
+#              "recibidos": int, "total": int, "buf": bytearray o None}}
+# "total" vale -1 hasta que llega la metadata; la transferencia está
+# completa cuando recibidos == total
+# Los chunks que llegan antes que la metadata esperan en un dict; con ella
+# se prealoca el destino (ver asignar_metadata)
+# Acotados: como máximo MAX_TRANSFERENCIAS timestamps activos por buffer
+# (se descarta el menos reciente) y las entradas sin completar se eliminan
+# tras TTL_TRANSFERENCIA segundos, para no acumular envíos abortados
+foto_chunks_buffer = OrderedDict()
+audio_chunks_buffer = OrderedDict()
+# Protege ambos buffers y sus entradas: toda lectura o escritura (obtener
+# entrada, guardar chunk o metadata, extraer, expirar) se hace con él tomado
+BUFFERS_LOCK = threading.Lock()
+MAX_TRANSFERENCIAS = 16
+TTL_TRANSFERENCIA = 300
+INTERVALO_LIMPIEZA = 30
+
+# Espera por el audio antes de procesar una foto completa (segundos)
+ESPERA_AUDIO = 2.0
+
+# Tareas diferidas (espera del audio, limpieza de buffers): un único hilo
+# las atiende en orden de vencimiento en lugar de un Timer por tarea. Corren
+# en paralelo con el hilo de red de paho, así que toda tarea que toque los
+# buffers de chunks debe tomar BUFFERS_LOCK (limpiar_buffers y
+# extraer_si_completo lo hacen)
+# Heap de (instante, secuencia, funcion, args)
+tareas_diferidas = []
+condicion_tareas = threading.Condition()
+secuencia_tareas = itertools.count()
+hilo_tareas = None
 
 # ============================================================================
 # CALLBACKS MQTT
@@ -42,55 +134,62 @@ audio_chunks_buffer = {}
 def on_connect(client, userdata, flags, rc):
     """Callback cuando se conecta al broker MQTT"""
     if rc == 0:
-        print(f"✓ Conectado al broker MQTT: {MQTT_BROKER}")
+        log.info(f"✓ Conectado al broker MQTT: {MQTT_BROKER}")
         
         # Suscribirse a topics de Arduino
         client.subscribe(MQTT_TOPIC_SENSORES, qos=1)
         client.subscribe(MQTT_TOPIC_STATUS, qos=1)
-        print(f"✓ Suscrito a: {MQTT_TOPIC_SENSORES}")
-        print(f"✓ Suscrito a: {MQTT_TOPIC_STATUS}")
+        log.info(f"✓ Suscrito a: {MQTT_TOPIC_SENSORES}")
+        log.info(f"✓ Suscrito a: {MQTT_TOPIC_STATUS}")
         
         # Suscribirse a topics de cámara Android
-        client.subscribe(MQTT_TOPIC_FOTO, qos=1)
-        client.subscribe(MQTT_TOPIC_AUDIO, qos=1)
+        client.subscribe(f"{MQTT_TOPIC_FOTO}/#", qos=1)
+        client.subscribe(f"{MQTT_TOPIC_AUDIO}/#", qos=1)
         client.subscribe(MQTT_TOPIC_STATUS_CAMARA, qos=1)
-        print(f"✓ Suscrito a: {MQTT_TOPIC_FOTO}")
-        print(f"✓ Suscrito a: {MQTT_TOPIC_AUDIO}")
-        print(f"✓ Suscrito a: {MQTT_TOPIC_STATUS_CAMARA}")
+        log.info(f"✓ Suscrito a: {MQTT_TOPIC_FOTO}/#")
+        log.info(f"✓ Suscrito a: {MQTT_TOPIC_AUDIO}/#")
+        log.info(f"✓ Suscrito a: {MQTT_TOPIC_STATUS_CAMARA}")
     else:
-        print(f"✗ Error de conexión MQTT. Código: {rc}")
+        log.error(f"✗ Error de conexión MQTT. Código: {rc}")
+
+def on_socket_open(client, userdata, sock):
+    """Desactiva Nagle en el socket MQTT para no retrasar mensajes pequeños"""
+    try:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    except (OSError, AttributeError):
+        pass
 
 def on_disconnect(client, userdata, rc):
     """Callback cuando se desconecta del broker"""
     if rc != 0:
-        print(f"⚠️  Desconexión inesperada del broker MQTT. Código: {rc}")
-        print("   Intentando reconectar...")
+        log.warning(f"⚠️  Desconexión inesperada del broker MQTT. Código: {rc}")
+        log.info("   Intentando reconectar...")
 
 def on_message(client, userdata, msg):
     """Callback cuando llega un mensaje MQTT"""
     try:
         topic = msg.topic
-        payload = msg.payload.decode('utf-8')
+        payload = msg.payload
         
-        print(f"\n📩 Mensaje MQTT recibido:")
-        print(f"   Topic: {topic}")
-        print(f"   Payload: {payload[:100]}...")  # Primeros 100 caracteres
+        log.info(f"\n📩 Mensaje MQTT recibido:")
+        log.info(f"   Topic: {topic}")
+        log.info(f"   Payload: {payload[:100].decode('utf-8', 'replace')}...")  # Primeros 100 bytes
         
         # Procesar según el topic
         if topic == MQTT_TOPIC_SENSORES:
-            # Es un mensaje de datos de sensores
-            data = json.loads(payload)
-            print(f"   🌡️  Temperatura: {data.get('temperatura')}°C")
-            print(f"   💡 Luz: {data.get('luz')} lux")
+            # Es un mensaje de datos de sensores (loads acepta bytes)
+            data = loads(payload)
+            log.info(f"   🌡️  Temperatura: {data.get('temperatura')}°C")
+            log.info(f"   💡 Luz: {data.get('luz')} lux")
             
             # Aquí puedes llamar a tu función para procesar los datos
             # Por ejemplo: procesar_datos_sensores(data)
             
         elif topic == MQTT_TOPIC_STATUS:
-            print(f"   ℹ️  Status del Arduino: {payload}")
+            log.info(f"   ℹ️  Status del Arduino: {payload.decode('utf-8')}")
             
     except Exception as e:
-        print(f"✗ Error procesando mensaje MQTT: {e}")
+        log.error(f"✗ Error procesando mensaje MQTT: {e}")
 
 # ============================================================================
 # FUNCIONES PRINCIPALES
@@ -100,6 +199,8 @@ def inicializar_mqtt():
     """Inicializa la conexión MQTT"""
     global mqtt_client
     
+    iniciar_logging()
+    
     try:
         # Crear cliente MQTT
         client_id = f"unsa_fire_server_{datetime.now().strftime('%Y%m%d%H%M%S')}"
@@ -109,18 +210,22 @@ def inicializar_mqtt():
         mqtt_client.on_connect = on_connect
         mqtt_client.on_disconnect = on_disconnect
         mqtt_client.on_message = on_message_with_callback
+        mqtt_client.on_socket_open = on_socket_open
         
         # Conectar al broker
-        print(f"\n🔌 Conectando a MQTT broker: {MQTT_BROKER}:{MQTT_PORT}")
+        log.info(f"\n🔌 Conectando a MQTT broker: {MQTT_BROKER}:{MQTT_PORT}")
         mqtt_client.connect(MQTT_BROKER, MQTT_PORT, MQTT_KEEPALIVE)
         
         # Iniciar loop en segundo plano
         mqtt_client.loop_start()
         
+        # Barrido periódico de transferencias abandonadas
+        programar_limpieza_buffers()
+        
         return mqtt_client
         
     except Exception as e:
-        print(f"✗ Error al inicializar MQTT: {e}")
+        log.error(f"✗ Error al inicializar MQTT: {e}")
         return None
 
 def publicar_comando(comando):
@@ -128,13 +233,13 @@ def publicar_comando(comando):
     if mqtt_client and mqtt_client.is_connected():
         try:
             mqtt_client.publish(MQTT_TOPIC_COMANDO, comando)
-            print(f"✓ Comando publicado: {comando}")
+            log.info(f"✓ Comando publicado: {comando}")
             return True
         except Exception as e:
-            print(f"✗ Error al publicar comando: {e}")
+            log.error(f"✗ Error al publicar comando: {e}")
             return False
     else:
-        print("✗ Cliente MQTT no conectado")
+        log.error("✗ Cliente MQTT no conectado")
         return False
 
 def solicitar_captura_mqtt():
@@ -144,33 +249,192 @@ def solicitar_captura_mqtt():
     """
     if mqtt_client and mqtt_client.is_connected():
         try:
-            comando = json.dumps({
+            comando = dumps({
                 "accion": "CAPTURAR",
                 "timestamp": datetime.now().isoformat()
             })
             mqtt_client.publish(MQTT_TOPIC_COMANDO_CAMARA, comando, qos=1)
-            print(f"✓ Comando de captura enviado a cámara vía MQTT")
+            log.info(f"✓ Comando de captura enviado a cámara vía MQTT")
             return True
         except Exception as e:
-            print(f"✗ Error al solicitar captura por MQTT: {e}")
+            log.error(f"✗ Error al solicitar captura por MQTT: {e}")
             return False
     else:
-        print("✗ Cliente MQTT no conectado")
+        log.error("✗ Cliente MQTT no conectado")
         return False
 
-def reconstruir_desde_chunks(chunks_dict):
-    """Reconstruye datos base64 desde múltiples chunks"""
+def reconstruir_desde_chunks(chunks, compresion=None):
+    """
+    Reconstruye los bytes del archivo desde la lista de chunks binarios,
+    ya ordenada por chunk_id.
+    Si la cámara los comprimió (compresion="zlib"), cada chunk se
+    descomprime por separado.
+    """
     try:
-        # Ordenar chunks por chunk_id
-        chunks_ordenados = sorted(chunks_dict.items())
-        # Concatenar todos los datos
-        data_completo = ''.join([chunk['data'] for _, chunk in chunks_ordenados])
-        return data_completo
+        if compresion == "zlib":
+            return b''.join(zlib.decompress(chunk) for chunk in chunks)
+        return b''.join(chunks)
     except Exception as e:
-        print(f"✗ Error al reconstruir chunks: {e}")
+        log.error(f"✗ Error al reconstruir chunks: {e}")
+        return None
+
+def parsear_topic_chunk(topic, prefijo):
+    """Extrae (timestamp, chunk_id) de '{prefijo}{timestamp}/{chunk_id}'"""
+    timestamp, _, chunk_id = topic[len(prefijo):].rpartition('/')
+    return timestamp, int(chunk_id)
+
+def obtener_entrada_buffer(buffer, timestamp):
+    """
+    Devuelve (creándola si no existe) la entrada del buffer para un
+    timestamp. Se llama con BUFFERS_LOCK tomado
+    """
+    if timestamp not in buffer:
+        buffer[timestamp] = {"meta": None, "chunks": {}, "recibidos": 0, "total": -1,
+                             "buf": None, "creado": time.monotonic()}
+        if len(buffer) > MAX_TRANSFERENCIAS:
+            descartado, _ = buffer.popitem(last=False)
+            log.warning(f"⚠️  Buffer lleno, se descarta la transferencia {descartado}")
+    else:
+        buffer.move_to_end(timestamp)
+    return buffer[timestamp]
+
+def limpiar_buffers():
+    """Elimina transferencias incompletas más antiguas que TTL_TRANSFERENCIA"""
+    limite = time.monotonic() - TTL_TRANSFERENCIA
+    expiradas = []
+    with BUFFERS_LOCK:
+        for buffer in (foto_chunks_buffer, audio_chunks_buffer):
+            for timestamp, entrada in list(buffer.items()):
+                if entrada["creado"] < limite:
+                    del buffer[timestamp]
+                    expiradas.append(timestamp)
+    for timestamp in expiradas:
+        log.info(f"🗑️  Transferencia incompleta expirada: {timestamp}")
+
+def programar_tarea(retraso, funcion, *args):
+    """Programa funcion(*args) para dentro de `retraso` segundos"""
+    global hilo_tareas
+    with condicion_tareas:
+        heapq.heappush(tareas_diferidas,
+                       (time.monotonic() + retraso, next(secuencia_tareas), funcion, args))
+        if hilo_tareas is None:
+            hilo_tareas = threading.Thread(target=ejecutar_tareas_diferidas,
+                                           name="tareas_mqtt", daemon=True)
+            hilo_tareas.start()
+        condicion_tareas.notify()
+
+def ejecutar_tareas_diferidas():
+    """Hilo que ejecuta las tareas programadas a medida que vencen"""
+    while True:
+        with condicion_tareas:
+            while True:
+                if not tareas_diferidas:
+                    condicion_tareas.wait()
+                    continue
+                espera = tareas_diferidas[0][0] - time.monotonic()
+                if espera <= 0:
+                    break
+                condicion_tareas.wait(espera)
+            _, _, funcion, args = heapq.heappop(tareas_diferidas)
+
+        try:
+            funcion(*args)
+        except Exception as e:
+            log.error(f"✗ Error en tarea diferida: {e}")
+
+def programar_limpieza_buffers():
+    """Ejecuta limpiar_buffers cada INTERVALO_LIMPIEZA segundos"""
+    def tarea():
+        try:
+            limpiar_buffers()
+        finally:
+            programar_limpieza_buffers()
+
+    programar_tarea(INTERVALO_LIMPIEZA, tarea)
+
+def guardar_chunk(entrada, chunk_id, data):
+    """
+    Guarda un chunk en su posición (o en espera si aún no hay metadata).
+    Retorna True si con él la transferencia quedó completa.
+    """
+    buf = entrada["buf"]
+    if buf is not None:
+        # Archivo sin comprimir: se copia directo a su offset en el bytearray
+        mask = entrada["chunks"]
+        if 0 <= chunk_id < entrada["total"]:
+            offset = chunk_id * entrada["meta"]["chunk_size"]
+            buf[offset:offset + len(data)] = data
+            if not mask[chunk_id]:
+                mask[chunk_id] = 1
+                entrada["recibidos"] += 1
+    elif entrada["total"] >= 0:
+        chunks = entrada["chunks"]
+        if 0 <= chunk_id < entrada["total"]:
+            if chunks[chunk_id] is None:
+                entrada["recibidos"] += 1
+            chunks[chunk_id] = data
+    else:
+        entrada["chunks"][chunk_id] = data
+
+    return entrada["recibidos"] == entrada["total"]
+
+def asignar_metadata(entrada, meta):
+    """
+    Registra la metadata y prealoca el destino de los chunks, moviendo a él
+    los que llegaron antes:
+    - sin compresión y con chunk_size: un bytearray de `size` bytes donde
+      cada chunk se copia a su offset; "chunks" pasa a ser una máscara de
+      total_chunks bytes que marca los recibidos
+    - con compresión (chunks de tamaño variable): una lista de total_chunks
+      posiciones indexada por chunk_id
+    """
+    if entrada["meta"] is not None:
+        # Metadata reentregada (QoS 1): el destino ya existe
+        return
+    entrada["meta"] = meta
+
+    total = meta.get("total_chunks") or 0
+    pendientes = entrada["chunks"]
+    entrada["recibidos"] = 0
+    entrada["total"] = total
+    if not meta.get("compresion") and meta.get("chunk_size") and meta.get("size") is not None:
+        entrada["buf"] = bytearray(meta["size"])
+        entrada["chunks"] = bytearray(total)
+    else:
+        entrada["chunks"] = [None] * total
+
+    for chunk_id, data in pendientes.items():
+        guardar_chunk(entrada, chunk_id, data)
+
+def extraer_si_completo(buffer, timestamp):
+    """
+    Si ya llegaron la metadata y todos los chunks de un timestamp,
+    reconstruye el archivo, verifica su integridad y lo saca del buffer.
+    Retorna los bytes o None si aún está incompleto.
+    """
+    with BUFFERS_LOCK:
+        entrada = buffer.get(timestamp)
+        if not entrada or entrada["recibidos"] != entrada["total"]:
+            return None
+        del buffer[timestamp]
+
+    # Fuera del buffer la entrada ya no la toca otro hilo: se reconstruye
+    # y verifica sin el lock
+    meta = entrada["meta"]
+    if entrada["buf"] is not None:
+        # Los chunks ya están en su sitio: no hay nada que unir
+        data = entrada["buf"]
+    else:
+        data = reconstruir_desde_chunks(entrada["chunks"], meta.get("compresion"))
+
+    sha256 = meta.get("sha256")
+    if data is not None and sha256 and hashlib.sha256(data).hexdigest() != sha256:
+        log.error(f"✗ Hash inválido para {timestamp}, archivo descartado")
         return None
 
-def verificar_multimedia_completa(timestamp, foto_base64):
+    return data
+
+def verificar_multimedia_completa(timestamp, foto_bytes):
     """
     Verifica si tenemos foto + audio completos y llama al callback
     """
@@ -178,24 +442,34 @@ def verificar_multimedia_completa(timestamp, foto_base64):
     
     try:
         # Verificar si hay audio para este timestamp
-        audio_base64 = None
-        if timestamp in audio_chunks_buffer:
-            print(f"   ✓ Audio también disponible")
-            audio_base64 = reconstruir_desde_chunks(audio_chunks_buffer[timestamp])
-            del audio_chunks_buffer[timestamp]
+        audio_bytes = extraer_si_completo(audio_chunks_buffer, timestamp)
+        if audio_bytes is not None:
+            log.info(f"   ✓ Audio también disponible")
         
         # Llamar al callback con los datos completos
-        if callback_multimedia_completa and foto_base64:
-            print(f"\n📤 Procesando multimedia completa...")
+        if callback_multimedia_completa and foto_bytes:
+            log.info(f"\n📤 Procesando multimedia completa...")
             callback_multimedia_completa({
-                "imagen": foto_base64,
-                "audio": audio_base64,
+                "imagen": foto_bytes,
+                "audio": audio_bytes,
                 "timestamp": timestamp,
                 "dispositivo": "camara_mqtt_android"
             })
         
     except Exception as e:
-        print(f"✗ Error al verificar multimedia: {e}")
+        log.error(f"✗ Error al verificar multimedia: {e}")
+
+def verificar_foto_completa(timestamp):
+    """Si la foto está completa, espera al audio y lanza el procesamiento"""
+    foto_bytes = extraer_si_completo(foto_chunks_buffer, timestamp)
+    if foto_bytes is None:
+        return
+
+    log.info(f"   ✓ Todos los chunks de foto recibidos ({len(foto_bytes)} bytes)")
+
+    # Verificar si también tenemos audio
+    # (dar tiempo para que llegue el audio)
+    programar_tarea(ESPERA_AUDIO, verificar_multimedia_completa, timestamp, foto_bytes)
 
 def detener_mqtt():
     """Detiene la conexión MQTT"""
@@ -203,7 +477,8 @@ def detener_mqtt():
     if mqtt_client:
         mqtt_client.loop_stop()
         mqtt_client.disconnect()
-        print("✓ Conexión MQTT cerrada")
+        log.info("✓ Conexión MQTT cerrada")
+    detener_logging()
 
 # ============================================================================
 # CALLBACK PERSONALIZADO PARA INTEGRAR CON server.py
@@ -227,7 +502,7 @@ def set_callback_sensores(callback):
     """
     global callback_datos_sensores
     callback_datos_sensores = callback
-    print("✓ Callback de sensores configurado")
+    log.info("✓ Callback de sensores configurado")
 
 def set_callback_multimedia(callback):
     """
@@ -236,14 +511,15 @@ def set_callback_multimedia(callback):
     
     El callback debe aceptar:
     {
-        "foto_base64": str,
-        "audio_base64": str or None,
-        "timestamp": str
+        "imagen": bytes o bytearray,
+        "audio": bytes, bytearray o None,
+        "timestamp": str,
+        "dispositivo": str
     }
     """
     global callback_multimedia_completa
     callback_multimedia_completa = callback
-    print("✓ Callback de multimedia configurado")
+    log.info("✓ Callback de multimedia configurado")
 
 def procesar_datos_mqtt(topic, data):
     """Procesa los datos recibidos por MQTT y llama al callback"""
@@ -251,13 +527,68 @@ def procesar_datos_mqtt(topic, data):
         try:
             callback_datos_sensores(data)
         except Exception as e:
-            print(f"✗ Error en callback de sensores: {e}")
+            log.error(f"✗ Error en callback de sensores: {e}")
     elif topic in [MQTT_TOPIC_FOTO, MQTT_TOPIC_AUDIO] and callback_multimedia_completa:
         try:
             # Aquí asumimos que 'data' contiene el diccionario completo con foto y audio
             callback_multimedia_completa(data)
         except Exception as e:
-            print(f"✗ Error en callback de multimedia: {e}")
+            log.error(f"✗ Error en callback de multimedia: {e}")
+
+def manejar_sensores(payload):
+    """Lectura de sensores del Arduino"""
+    data = loads(payload)
+    log.info(f"   🌡️  Temperatura: {data.get('temperatura')}°C")
+    log.info(f"   💡 Luz: {data.get('luz')} lux")
+    
+    # Llamar al callback si está configurado
+    if callback_datos_sensores:
+        callback_datos_sensores(data)
+
+def manejar_status(payload):
+    log.info(f"   ℹ️  Status: {payload.decode('utf-8')}")
+
+def manejar_status_camara(payload):
+    log.info(f"   📷 Status cámara: {payload.decode('utf-8')}")
+
+def manejar_foto_metadata(payload):
+    """Metadata de foto: tamaño, total de chunks y hash"""
+    data = loads(payload)
+    timestamp = data.get('timestamp')
+    
+    # La última foto de la secuencia trae el cierre en su metadata
+    if data.get('fin_secuencia'):
+        log.info(f"   ✅ Fin de secuencia: {data.get('cantidad_fotos')} foto(s) enviadas por la cámara")
+    
+    # Foto casi idéntica a otra de la misma ráfaga: no llegan chunks
+    if data.get('duplicate_of'):
+        log.info(f"   ♻️  Foto {timestamp} duplicada de {data['duplicate_of']}, se omite")
+        return
+    
+    log.info(f"   📷 Metadata de foto: {data.get('size')} bytes en {data.get('total_chunks')} chunk(s)")
+    
+    with BUFFERS_LOCK:
+        asignar_metadata(obtener_entrada_buffer(foto_chunks_buffer, timestamp), data)
+    verificar_foto_completa(timestamp)
+
+def manejar_audio_metadata(payload):
+    """Metadata de audio"""
+    data = loads(payload)
+    timestamp = data.get('timestamp')
+    
+    log.info(f"   🎤 Metadata de audio: {data.get('size')} bytes en {data.get('total_chunks')} chunk(s)")
+    
+    with BUFFERS_LOCK:
+        asignar_metadata(obtener_entrada_buffer(audio_chunks_buffer, timestamp), data)
+
+# Topics exactos -> manejador (los chunks se reconocen antes por prefijo)
+MANEJADORES_TOPIC = {
+    MQTT_TOPIC_SENSORES: manejar_sensores,
+    MQTT_TOPIC_STATUS: manejar_status,
+    MQTT_TOPIC_STATUS_CAMARA: manejar_status_camara,
+    MQTT_TOPIC_FOTO_METADATA: manejar_foto_metadata,
+    MQTT_TOPIC_AUDIO_METADATA: manejar_audio_metadata,
+}
 
 # Modificar on_message para usar el callback
 def on_message_with_callback(client, userdata, msg):
@@ -266,87 +597,42 @@ def on_message_with_callback(client, userdata, msg):
     
     try:
         topic = msg.topic
-        payload = msg.payload.decode('utf-8')
         
-        print(f"\n📩 Mensaje MQTT recibido:")
-        print(f"   Topic: {topic}")
-        
-        if topic == MQTT_TOPIC_SENSORES:
-            data = json.loads(payload)
-            print(f"   🌡️  Temperatura: {data.get('temperatura')}°C")
-            print(f"   💡 Luz: {data.get('luz')} lux")
-            
-            # Llamar al callback si está configurado
-            if callback_datos_sensores:
-                callback_datos_sensores(data)
-            
-        elif topic == MQTT_TOPIC_STATUS:
-            print(f"   ℹ️  Status: {payload}")
-            
-        elif topic == MQTT_TOPIC_STATUS_CAMARA:
-            print(f"   📷 Status cámara: {payload}")
-            
-        elif topic == MQTT_TOPIC_FOTO:
-            # Mensaje con chunk de foto
-            data = json.loads(payload)
-            chunk_id = data.get('chunk_id')
-            total_chunks = data.get('total_chunks')
-            timestamp = data.get('timestamp')
-            
-            print(f"   📷 Foto chunk {chunk_id+1}/{total_chunks}")
+        if topic.startswith(MQTT_TOPIC_FOTO_CHUNK):
+            # Chunk binario de foto (bytes crudos, sin decodificar)
+            timestamp, chunk_id = parsear_topic_chunk(topic, MQTT_TOPIC_FOTO_CHUNK)
+            with BUFFERS_LOCK:
+                entrada = obtener_entrada_buffer(foto_chunks_buffer, timestamp)
+                completo = guardar_chunk(entrada, chunk_id, msg.payload)
+                total_chunks = entrada["total"] if entrada["total"] >= 0 else "?"
+            log.debug(f"   📷 Foto chunk {chunk_id+1}/{total_chunks}")
             
-            # Guardar chunk
-            if timestamp not in foto_chunks_buffer:
-                foto_chunks_buffer[timestamp] = {}
-            
-            foto_chunks_buffer[timestamp][chunk_id] = data
-            
-            # Verificar si tenemos todos los chunks
-            if len(foto_chunks_buffer[timestamp]) == total_chunks:
-                print(f"   ✓ Todos los chunks de foto recibidos")
-                
-                # Reconstruir foto completa
-                foto_base64 = reconstruir_desde_chunks(foto_chunks_buffer[timestamp])
-                
-                # Limpiar buffer
-                del foto_chunks_buffer[timestamp]
-                
-                # Verificar si también tenemos audio
-                # (dar tiempo para que llegue el audio)
-                import threading
-                threading.Timer(
-                    2.0,
-                    verificar_multimedia_completa,
-                    args=(timestamp, foto_base64)
-                ).start()
+            if completo:
+                verificar_foto_completa(timestamp)
+            return
         
-        elif topic == MQTT_TOPIC_AUDIO:
-            # Mensaje con chunk de audio
-            data = json.loads(payload)
-            chunk_id = data.get('chunk_id')
-            total_chunks = data.get('total_chunks')
-            timestamp = data.get('timestamp')
-            
-            print(f"   🎤 Audio chunk {chunk_id+1}/{total_chunks}")
-            
-            # Guardar chunk
-            if timestamp not in audio_chunks_buffer:
-                audio_chunks_buffer[timestamp] = {}
-            
-            audio_chunks_buffer[timestamp][chunk_id] = data
-            
-            # Verificar si tenemos todos los chunks
-            if len(audio_chunks_buffer[timestamp]) == total_chunks:
-                print(f"   ✓ Todos los chunks de audio recibidos")
-            # Aquí podrías agregar código para manejar la foto recibida
-            
-        elif topic == MQTT_TOPIC_AUDIO:
-            # Mensaje con audio
-            print("   🎵 Audio recibido")
-            # Aquí podrías agregar código para manejar el audio recibido
+        if topic.startswith(MQTT_TOPIC_AUDIO_CHUNK):
+            # Chunk binario de audio
+            timestamp, chunk_id = parsear_topic_chunk(topic, MQTT_TOPIC_AUDIO_CHUNK)
+            with BUFFERS_LOCK:
+                entrada = obtener_entrada_buffer(audio_chunks_buffer, timestamp)
+                guardar_chunk(entrada, chunk_id, msg.payload)
+                total_chunks = entrada["total"] if entrada["total"] >= 0 else "?"
+            log.debug(f"   🎤 Audio chunk {chunk_id+1}/{total_chunks}")
+            return
+        
+        manejador = MANEJADORES_TOPIC.get(topic)
+        if manejador is None:
+            return
+        
+        log.info(f"\n📩 Mensaje MQTT recibido:")
+        log.info(f"   Topic: {topic}")
+        
+        # Los JSON se parsean directamente desde bytes, sin decodificar a str
+        manejador(msg.payload)
             
     except Exception as e:
-        print(f"✗ Error procesando mensaje MQTT: {e}")
+        log.error(f"✗ Error procesando mensaje MQTT: {e}")
 
 # ============================================================================
 # MAIN - Para pruebas
@@ -366,7 +652,6 @@ if __name__ == "__main__":
         
         try:
             # Mantener el programa corriendo
-            import time
             while True:
                 time.sleep(1)
         except KeyboardInterrupt:
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Script para cuantizar el modelo Keras de detección de fuego.
+Genera en models/:
+  - fire_model_fp16.tflite: pesos en float16, preferido por server.py en x86
+  - fire_model_int8.tflite: int8 completo, preferido por server.py en ARM
+
+Uso:
+    python quantize_fire_model.py [carpeta_de_imagenes]
+
+Las imágenes (por defecto uploads/images) se usan como dataset
+representativo para calibrar los rangos de activación del modelo int8.
+Sin imágenes solo se genera el modelo float16.
+"""
+
+import os
+import sys
+
+# Directorio donde están los modelos
+MODELS_DIR = os.path.join(os.path.dirname(__file__), "models")
+KERAS_MODEL = os.path.join(MODELS_DIR, "fire_model.h5")
+INT8_MODEL = os.path.join(MODELS_DIR, "fire_model_int8.tflite")
+FP16_MODEL = os.path.join(MODELS_DIR, "fire_model_fp16.tflite")
+
+# Carpeta de imágenes de calibración por defecto
+IMAGES_DIR = os.path.join(os.path.dirname(__file__), "uploads", "images")
+
+# Imágenes usadas para calibrar (más no mejora mucho la precisión)
+MAX_CALIBRATION_IMAGES = 200
+
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png'}
+
+def representative_dataset(images_dir, input_shape):
+    """
+    Generador con el mismo preprocesamiento que predecir_fuego en server.py:
+    RGB, redimensionado con INTER_AREA y normalizado a [0, 1]
+    """
+    import cv2
+    import numpy as np
+
+    alto, ancho = input_shape
+    archivos = [
+        entry.path for entry in os.scandir(images_dir)
+        if entry.is_file() and os.path.splitext(entry.name)[1].lower() in IMAGE_EXTENSIONS
+    ][:MAX_CALIBRATION_IMAGES]
+
+    if not archivos:
+        raise RuntimeError(f"No hay imágenes de calibración en {images_dir}")
+
+    print(f"📸 Calibrando con {len(archivos)} imágenes")
+
+    def generador():
+        for path in archivos:
+            img = cv2.imread(path, cv2.IMREAD_COLOR)
+            if img is None:
+                continue
+            img = cv2.resize(img, (ancho, alto), interpolation=cv2.INTER_AREA)
+            arr = img[:, :, ::-1].astype(np.float32) / 255.0
+            yield [arr[np.newaxis]]
+
+    return generador
+
+def guardar_modelo(tflite_model, path):
+    """Escribe el modelo convertido y muestra su tamaño frente al original"""
+    with open(path, 'wb') as f:
+        f.write(tflite_model)
+
+    print(f"\n✅ ¡Modelo cuantizado exitosamente!")
+    print(f"📁 Ubicación: {path}")
+    print(f"📊 Tamaño: {os.path.getsize(path) / 1024:.2f} KB "
+          f"(original: {os.path.getsize(KERAS_MODEL) / 1024:.2f} KB)")
+
+def main():
+    print("=" * 60)
+    print("🔥 Cuantización del Modelo de Detección de Fuego")
+    print("=" * 60)
+
+    images_dir = sys.argv[1] if len(sys.argv) > 1 else IMAGES_DIR
+
+    if not os.path.exists(KERAS_MODEL):
+        print(f"❌ No se encontró el modelo Keras: {KERAS_MODEL}")
+        return 1
+
+    import tensorflow as tf
+
+    print(f"🔁 Cargando modelo Keras desde {KERAS_MODEL}")
+    model = tf.keras.models.load_model(KERAS_MODEL)
+    input_shape = (model.input_shape[1], model.input_shape[2])
+
+    # float16: sin calibración, misma entrada y salida float que el original
+    print("\n🔄 Convirtiendo a float16...")
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    converter.target_spec.supported_types = [tf.float16]
+    try:
+        guardar_modelo(converter.convert(), FP16_MODEL)
+    except Exception as e:
+        print(f"❌ Error al convertir a float16: {e}")
+        return 1
+
+    print("\n🔄 Convirtiendo a int8...")
+    try:
+        dataset = representative_dataset(images_dir, input_shape)
+    except RuntimeError as e:
+        print(f"⚠️  {e}: se omite el modelo int8")
+        return 0
+
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    converter.representative_dataset = dataset
+    # Solo operaciones int8, con entrada y salida uint8: el servidor pasa
+    # los píxeles tal cual y descuantiza la salida
+    converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+    converter.inference_input_type = tf.uint8
+    converter.inference_output_type = tf.uint8
+
+    try:
+        guardar_modelo(converter.convert(), INT8_MODEL)
+    except Exception as e:
+        print(f"❌ Error al convertir a int8: {e}")
+        return 1
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
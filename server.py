@@ -3,18 +3,31 @@ Servidor Backend - Sistema IoT de Detección de Incendios
 Universidad Nacional de San Agustín - Arequipa, Perú
 """
 
-from fastapi import FastAPI, HTTPException, File, UploadFile, Form
+from fastapi import FastAPI, HTTPException, File, UploadFile, Form, Request, Response
+from fastapi.routing import APIRoute
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse, FileResponse
+from fastapi.responses import HTMLResponse, FileResponse, JSONResponse, ORJSONResponse
 from pydantic import BaseModel
-from typing import Optional, List
+from typing import Optional, List, Callable, Union, NamedTuple, Tuple
 import uvicorn
 import json
+import zlib
 import sqlite3
+import asyncio
+import threading
+import queue
+import time
+from functools import lru_cache
+from contextlib import contextmanager
+from concurrent.futures import Future, ThreadPoolExecutor
+from collections import deque, OrderedDict
 from datetime import datetime
-import base64
+import binascii
+import hashlib
 import os
+import shutil
+import platform
 from pathlib import Path
 
 from telegram_config import enviar_mensaje_telegram, notificar_fuego_confirmado
@@ -27,7 +40,79 @@ from mqtt_config import (
 )
 import requests
 
-app = FastAPI(title="Fire Detection Server", version="1.0.0")
+# numpy y OpenCV son opcionales al importar: sin ellos el servidor arranca y
+# predecir_fuego responde sin análisis
+try:
+    import numpy as np
+    import cv2
+except ImportError:
+    np = None
+    cv2 = None
+
+# orjson es opcional: serializa más rápido que json. La columna datos_json
+# sigue siendo TEXT, así que siempre se devuelve str. Con orjson también se
+# usa para todas las respuestas de la API (escribe bytes directamente)
+try:
+    import orjson
+
+    def dumps_texto(obj) -> str:
+        return orjson.dumps(obj).decode()
+
+    loads_texto = orjson.loads
+    RESPUESTA_JSON = ORJSONResponse
+except ImportError:
+    def dumps_texto(obj) -> str:
+        return json.dumps(obj)
+
+    loads_texto = json.loads
+    RESPUESTA_JSON = JSONResponse
+
+# Tamaño máximo del cuerpo ya descomprimido: un cuerpo gzip pequeño podría
+# inflarse a gigabytes (bomba de descompresión)
+MAX_CUERPO_DESCOMPRIMIDO = 32 * 1024 * 1024
+
+def descomprimir_gzip(body: bytes) -> bytes:
+    """Descomprime un cuerpo gzip sin pasar de MAX_CUERPO_DESCOMPRIMIDO (413 si lo supera)"""
+    descompresor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    try:
+        datos = descompresor.decompress(body, MAX_CUERPO_DESCOMPRIMIDO)
+    except zlib.error as e:
+        raise HTTPException(status_code=400, detail=f"Cuerpo gzip inválido: {e}")
+    # Si quedó entrada sin procesar es porque se alcanzó el límite de salida
+    if descompresor.unconsumed_tail:
+        raise HTTPException(status_code=413, detail="Cuerpo descomprimido demasiado grande")
+    if not descompresor.eof:
+        raise HTTPException(status_code=400, detail="Cuerpo gzip incompleto")
+    return datos
+
+class GzipRequest(Request):
+    """Request que descomprime el cuerpo si llega con Content-Encoding: gzip"""
+    async def body(self) -> bytes:
+        if not hasattr(self, "_body"):
+            body = await super().body()
+            if "gzip" in self.headers.getlist("Content-Encoding"):
+                body = descomprimir_gzip(body)
+            self._body = body
+        return self._body
+
+class GzipRoute(APIRoute):
+    """Ruta que acepta subidas comprimidas con gzip desde los clientes"""
+    def get_route_handler(self) -> Callable:
+        original_route_handler = super().get_route_handler()
+
+        async def custom_route_handler(request: Request) -> Response:
+            if "gzip" in request.headers.getlist("Content-Encoding"):
+                request = GzipRequest(request.scope, request.receive)
+                # Leer el cuerpo aquí: tanto JSON como multipart usan el
+                # cuerpo ya descomprimido
+                await request.body()
+            return await original_route_handler(request)
+
+        return custom_route_handler
+
+app = FastAPI(title="Fire Detection Server", version="1.0.0",
+              default_response_class=RESPUESTA_JSON)
+app.router.route_class = GzipRoute
 
 app.add_middleware(
     CORSMiddleware,
@@ -43,6 +128,22 @@ UMBRALES = {
     "luz_peligro": 1000
 }
 
+# Copia de UMBRALES en una tupla para evaluar_estado (sin búsquedas en el
+# dict por cada lectura). Se actualiza con refrescar_umbrales()
+UMBRALES_ACTIVOS = (
+    UMBRALES["temp_alerta"], UMBRALES["temp_peligro"],
+    UMBRALES["luz_alerta"], UMBRALES["luz_peligro"]
+)
+ESTADOS = ("Normal", "Alerta", "Peligro")
+
+def refrescar_umbrales():
+    """Vuelve a copiar UMBRALES en UMBRALES_ACTIVOS tras modificarlos"""
+    global UMBRALES_ACTIVOS
+    UMBRALES_ACTIVOS = (
+        UMBRALES["temp_alerta"], UMBRALES["temp_peligro"],
+        UMBRALES["luz_alerta"], UMBRALES["luz_peligro"]
+    )
+
 CAMARA_ANDROID_URL = "http://192.168.1.100:8080"
 DURACION_AUDIO = 5
 
@@ -53,6 +154,21 @@ ESTADO_SISTEMA = {
     "ultima_foto": None,
     "ultimo_analisis_ia": None
 }
+
+# ultima_lectura serializada, reutilizada mientras el dict no se reemplace:
+# cambia con cada lectura de sensores, no con cada análisis IA
+CACHE_ULTIMA_LECTURA = (None, dumps_texto(None))
+
+def ultima_lectura_json() -> str:
+    """ESTADO_SISTEMA["ultima_lectura"] como JSON, serializado una vez por lectura"""
+    global CACHE_ULTIMA_LECTURA
+    lectura = ESTADO_SISTEMA["ultima_lectura"]
+    objeto, texto = CACHE_ULTIMA_LECTURA
+    if lectura is not objeto:
+        texto = dumps_texto(lectura)
+        CACHE_ULTIMA_LECTURA = (lectura, texto)
+    return texto
+
 BASE_DIR = Path(__file__).parent
 UPLOADS_DIR = BASE_DIR / "uploads"
 IMAGES_DIR = UPLOADS_DIR / "images"
@@ -65,6 +181,23 @@ TEMPLATES_DIR = BASE_DIR / "templates"
 for directory in [UPLOADS_DIR, IMAGES_DIR, AUDIO_DIR, LOGS_DIR, MODELS_DIR, STATIC_DIR, TEMPLATES_DIR]:
     directory.mkdir(parents=True, exist_ok=True)
 
+# Prefijos precalculados para las rutas de guardado (sin construir Path
+# por cada captura)
+IMAGES_DIR_STR = f"{IMAGES_DIR}{os.sep}"
+AUDIO_DIR_STR = f"{AUDIO_DIR}{os.sep}"
+IMAGES_REL = "uploads/images/"
+AUDIO_REL = "uploads/audio/"
+
+def escribir_archivo(ruta: str, datos) -> None:
+    """Escribe bytes en `ruta` con os.open/os.write, sin objeto de archivo"""
+    fd = os.open(ruta, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, "O_BINARY", 0), 0o644)
+    try:
+        vista = memoryview(datos)
+        while vista:
+            vista = vista[os.write(fd, vista):]
+    finally:
+        os.close(fd)
+
 app.mount("/uploads", StaticFiles(directory=str(UPLOADS_DIR)), name="uploads")
 app.mount("/static", StaticFiles(directory=str(STATIC_DIR)), name="static")
 
@@ -72,11 +205,11 @@ def procesar_datos_mqtt(datos: dict):
     try:
         print(f"\n📡 Datos recibidos vía MQTT: Temp={datos.get('temperatura')}°C, Luz={datos.get('luz')} lux")
 
-        datos_sensores = DatosSensores(
-            temperatura=datos.get('temperatura', 0.0),
-            luz=datos.get('luz', 0.0),
-            humedad=datos.get('humedad', 0.0),
-            presion=datos.get('presion', 0.0)
+        datos_sensores = LecturaSensores(
+            float(datos.get('temperatura', 0.0)),
+            float(datos.get('luz', 0.0)),
+            float(datos.get('humedad', 0.0)),
+            float(datos.get('presion', 0.0))
         )
 
         estado = evaluar_estado(datos_sensores.temperatura, datos_sensores.luz)
@@ -85,7 +218,7 @@ def procesar_datos_mqtt(datos: dict):
             "luz": datos_sensores.luz,
             "humedad": datos_sensores.humedad,
             "presion": datos_sensores.presion,
-            "timestamp": datetime.now().isoformat()
+            "timestamp": ahora_iso()
         }
         
         estado_anterior = ESTADO_SISTEMA["estado_actual"]
@@ -113,28 +246,55 @@ def procesar_datos_mqtt(datos: dict):
     except Exception as e:
         print(f"✗ Error procesando datos MQTT: {e}")
 
+# Las notificaciones de Telegram se envían desde un hilo propio: la
+# petición HTTPS no retrasa el análisis ni la respuesta al cliente
+EJECUTOR_NOTIFICACIONES = ThreadPoolExecutor(max_workers=1, thread_name_prefix="telegram")
+
+def notificar_fuego(confianza: float, imagen_url: str):
+    try:
+        notificar_fuego_confirmado(confianza, imagen_url=imagen_url)
+    except Exception as e:
+        print(f"⚠️ Error al notificar por Telegram: {e}")
+
+def notificar_en_segundo_plano(confianza: float, imagen_url: str):
+    """Encola la notificación de fuego confirmado y retorna de inmediato"""
+    EJECUTOR_NOTIFICACIONES.submit(notificar_fuego, confianza, imagen_url)
+
+# Multimedia completa recibida por MQTT, pendiente de guardar y analizar.
+# El callback MQTT solo encola; hilo_multimedia hace el disco, la IA y la
+# base de datos sin bloquear la recepción de mensajes
+COLA_MULTIMEDIA = queue.SimpleQueue()
+
 def procesar_multimedia_mqtt(datos: dict):
+    """Callback MQTT: encola la multimedia para hilo_multimedia"""
+    COLA_MULTIMEDIA.put(datos)
+
+def hilo_multimedia():
+    """Hilo que procesa de a una las capturas encoladas por MQTT"""
+    while True:
+        procesar_multimedia(COLA_MULTIMEDIA.get())
+
+def procesar_multimedia(datos: dict):
     try:
         print(f"\n📸 Multimedia recibida vía MQTT")
         print(f"   Dispositivo: {datos.get('dispositivo')}")
         print(f"   Timestamp: {datos.get('timestamp')}")
 
-        imagen_base64 = datos.get('imagen')
-        if not imagen_base64:
+        # La cámara publica bytes crudos por MQTT (sin base64)
+        imagen_bytes = datos.get('imagen')
+        if not imagen_bytes:
             print("✗ No se recibió imagen")
             return
 
         timestamp_str = datetime.now().strftime("%Y%m%d_%H%M%S")
         imagen_filename = f"captura_{timestamp_str}.jpg"
-        imagen_path = IMAGES_DIR / imagen_filename
+        imagen_path = IMAGES_DIR_STR + imagen_filename
 
         try:
-            imagen_bytes = base64.b64decode(imagen_base64)
-            with open(imagen_path, 'wb') as f:
-                f.write(imagen_bytes)
+            escribir_archivo(imagen_path, imagen_bytes)
             print(f"💾 Imagen guardada: {imagen_path}")
 
-            imagen_rel = f"uploads/images/{imagen_filename}"
+            imagen_rel = IMAGES_REL + imagen_filename
             ESTADO_SISTEMA["ultima_foto"] = imagen_rel
 
         except Exception as e:
@@ -142,21 +302,20 @@ def procesar_multimedia_mqtt(datos: dict):
             return
         audio_path = None
         audio_rel = None
-        audio_base64 = datos.get('audio')
-        if audio_base64:
+        audio_bytes = datos.get('audio')
+        if audio_bytes:
             try:
                 audio_filename = f"audio_{timestamp_str}.wav"
-                audio_path = AUDIO_DIR / audio_filename
-                audio_bytes = base64.b64decode(audio_base64)
-                with open(audio_path, 'wb') as f:
-                    f.write(audio_bytes)
+                audio_path = AUDIO_DIR_STR + audio_filename
+                escribir_archivo(audio_path, audio_bytes)
                 print(f"💾 Audio guardado: {audio_path}")
-                audio_rel = f"uploads/audio/{audio_filename}"
+                audio_rel = AUDIO_REL + audio_filename
             except Exception as e:
                 print(f"⚠️  Error al guardar audio: {e}")
 
+        # La foto ya está en memoria: se analiza sin volver a leerla del disco
         print(f"🤖 Analizando imagen con IA...")
-        resultado_ia = predecir_fuego(str(imagen_path))
+        resultado_ia, imagen_sha256 = predecir_fuego_con_cache(imagen_bytes)
 
         fuego_detectado = resultado_ia["fuego_detectado"]
         confianza = resultado_ia["confianza"]
@@ -164,21 +323,18 @@ def procesar_multimedia_mqtt(datos: dict):
         print(f"   Fuego detectado: {'SÍ' if fuego_detectado else 'NO'}")
         print(f"   Confianza: {confianza:.2f}%")
 
-        conn = sqlite3.connect('fire_detection.db')
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT INTO analisis_ia (timestamp, imagen_path, audio_path, fuego_detectado, confianza, datos_sensores)
-            VALUES (?, ?, ?, ?, ?, ?)
+        ejecutar_db('''
+            INSERT INTO analisis_ia (timestamp, imagen_path, audio_path, fuego_detectado, confianza, datos_sensores, imagen_sha256)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
         ''', (
             datetime.now().isoformat(),
             imagen_rel,
             audio_rel if audio_rel else None,
             1 if fuego_detectado else 0,
             confianza,
-            json.dumps(ESTADO_SISTEMA.get("ultima_lectura"))
+            ultima_lectura_json(),
+            imagen_sha256
         ))
-        conn.commit()
-        conn.close()
 
         if fuego_detectado and confianza >= 75:
             ESTADO_SISTEMA["estado_actual"] = "Fuego_Confirmado"
@@ -191,10 +347,7 @@ def procesar_multimedia_mqtt(datos: dict):
             )
             print(f"🔥 FUEGO CONFIRMADO por IA (MQTT)")
 
-            try:
-                notificar_fuego_confirmado(confianza * 100, imagen_url=imagen_rel)
-            except Exception as e:
-                print(f"⚠️ Error al notificar por Telegram: {e}")
+            notificar_en_segundo_plano(confianza * 100, imagen_rel)
         else:
             ESTADO_SISTEMA["requiere_captura"] = False
             registrar_evento(
@@ -216,6 +369,9 @@ async def startup_event():
     init_database()
     print("✓ Base de datos inicializada")
 
+    threading.Thread(target=hilo_volcado_lecturas, name="volcado_lecturas", daemon=True).start()
+    threading.Thread(target=hilo_multimedia, name="multimedia_mqtt", daemon=True).start()
+
     try:
         normalize_db_paths()
     except Exception as e:
@@ -243,7 +399,10 @@ async def startup_event():
 @app.on_event("shutdown")
 async def shutdown_event():
     print("\n⏹️  Cerrando conexiones...")
+    volcar_lecturas()
     detener_mqtt()
+    INFERENCE_POOL.shutdown(wait=True)
+    cerrar_conexiones_db()
     print("✓ Servidor detenido")
 
 class DatosSensores(BaseModel):
@@ -252,6 +411,13 @@ class DatosSensores(BaseModel):
     humedad: float
     presion: float
 
+class LecturaSensores(NamedTuple):
+    """Lectura recibida por MQTT: mismos campos que DatosSensores, sin validación pydantic"""
+    temperatura: float
+    luz: float
+    humedad: float
+    presion: float
+
 class UploadMultimedia(BaseModel):
     imagen: str
     audio: Optional[str] = None
@@ -263,9 +429,104 @@ class ConfigUmbrales(BaseModel):
     luz_alerta: Optional[float] = None
     luz_peligro: Optional[float] = None
 
+# Conexión SQLite compartida para las escrituras frecuentes (sensores,
+# eventos, análisis MQTT): se abre una sola vez en modo WAL y autocommit,
+# en lugar de conectar, confirmar y cerrar en cada mensaje
+DB_PATH = 'fire_detection.db'
+# Una conexión por hilo, abierta la primera vez que el hilo la pide y
+# reutilizada después. En WAL los lectores no bloquean al escritor y las
+# escrituras concurrentes esperan su turno (timeout) en SQLite, sin un lock
+# global en Python
+DB_LOCAL = threading.local()
+DB_CONEXIONES = []
+DB_CONEXIONES_LOCK = threading.Lock()
+
+def conexion_db() -> sqlite3.Connection:
+    """Devuelve la conexión SQLite del hilo actual (en autocommit)"""
+    conn = getattr(DB_LOCAL, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(DB_PATH, timeout=10, check_same_thread=False,
+                               isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        DB_LOCAL.conn = conn
+        with DB_CONEXIONES_LOCK:
+            DB_CONEXIONES.append(conn)
+    return conn
+
+def cerrar_conexiones_db():
+    """Cierra las conexiones abiertas por todos los hilos"""
+    with DB_CONEXIONES_LOCK:
+        for conn in DB_CONEXIONES:
+            try:
+                conn.close()
+            except Exception:
+                pass
+        DB_CONEXIONES.clear()
+
+def ejecutar_db(sql: str, params: tuple = ()):
+    """Ejecuta una sentencia de escritura en la conexión del hilo actual"""
+    conexion_db().execute(sql, params)
+
+@contextmanager
+def transaccion_db():
+    """Agrupa las escrituras del hilo actual en una sola transacción (un commit)"""
+    conn = conexion_db()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+
+# Lecturas de sensores pendientes de guardar: se insertan por lotes
+# (executemany en una sola transacción) cada INTERVALO_VOLCADO segundos o
+# en cuanto se juntan LOTE_LECTURAS filas o llega una lectura en Peligro.
+# Acotado a 1024 filas
+LECTURAS_PENDIENTES = deque(maxlen=1024)
+LOTE_LECTURAS = 100
+INTERVALO_VOLCADO = 0.5
+EVENTO_VOLCADO = threading.Event()
+
+def volcar_lecturas():
+    """Inserta en un solo lote todas las lecturas pendientes"""
+    filas = []
+    while True:
+        try:
+            filas.append(LECTURAS_PENDIENTES.popleft())
+        except IndexError:
+            break
+    if not filas:
+        return
+
+    conn = conexion_db()
+    # IMMEDIATE toma el lock de escritura al empezar (esperando el timeout
+    # si otro hilo escribe) en lugar de fallar al pasar de lectura a escritura
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.executemany('''
+            INSERT INTO lecturas_sensores (timestamp, temperatura, luz, humedad, presion, estado)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', filas)
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+
+def hilo_volcado_lecturas():
+    """Hilo que vuelca las lecturas pendientes periódicamente o por tamaño"""
+    while True:
+        EVENTO_VOLCADO.wait(INTERVALO_VOLCADO)
+        EVENTO_VOLCADO.clear()
+        try:
+            volcar_lecturas()
+        except Exception as e:
+            print(f"✗ Error guardando lote de lecturas: {e}")
+
 def init_database():
-    conn = sqlite3.connect('fire_detection.db')
-    cursor = conn.cursor()
+    cursor = conexion_db().cursor()
 
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS lecturas_sensores (
@@ -297,52 +558,67 @@ def init_database():
             audio_path TEXT,
             fuego_detectado INTEGER,
             confianza REAL,
-            datos_sensores TEXT
+            datos_sensores TEXT,
+            imagen_sha256 TEXT
         )
     ''')
 
-    conn.commit()
-    conn.close()
+    # Bases de datos creadas antes de guardar el hash de la imagen
+    columnas = {fila[1] for fila in cursor.execute("PRAGMA table_info(analisis_ia)")}
+    if "imagen_sha256" not in columnas:
+        cursor.execute("ALTER TABLE analisis_ia ADD COLUMN imagen_sha256 TEXT")
+
+    # /api/ultimas-fotos recorre analisis_ia de la más reciente hacia atrás
+    # saltando filas sin imagen: el índice parcial solo contiene las que
+    # tienen foto. Los ORDER BY id DESC ya usan el rowid (id INTEGER PRIMARY KEY)
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_analisis_imagen
+        ON analisis_ia(id DESC) WHERE imagen_path IS NOT NULL
+    ''')
+
     print("✅ Base de datos inicializada correctamente")
 
 def normalize_db_paths():
+    """
+    Convierte a rutas relativas (uploads/...) las rutas absolutas guardadas
+    en analisis_ia, con un UPDATE por columna en lugar de uno por fila
+    """
     try:
-        conn = sqlite3.connect('fire_detection.db')
-        cursor = conn.cursor()
-        cursor.execute("SELECT id, imagen_path, audio_path FROM analisis_ia")
-        rows = cursor.fetchall()
-        updates = 0
-        for rid, ipath, apath in rows:
-            new_ipath = None
-            new_apath = None
-            if ipath:
-                if ipath.startswith('/') or str(BASE_DIR) in ipath:
-                    new_ipath = f"uploads/images/{os.path.basename(ipath)}"
-            if apath:
-                if apath.startswith('/') or str(BASE_DIR) in apath:
-                    new_apath = f"uploads/audio/{os.path.basename(apath)}"
-            if new_ipath or new_apath:
-                cursor.execute('''
-                    UPDATE analisis_ia
-                    SET imagen_path = COALESCE(?, imagen_path),
-                        audio_path = COALESCE(?, audio_path)
-                    WHERE id = ?
-                ''', (new_ipath, new_apath, rid))
-                updates += 1
-        conn.commit()
-        conn.close()
-        print(f"✅ Normalización de rutas en DB completada. Filas actualizadas: {updates}")
+        conn = conexion_db()
+        conn.create_function("basename", 1, os.path.basename, deterministic=True)
+        base_dir = str(BASE_DIR)
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            cursor = conn.execute('''
+                UPDATE analisis_ia
+                SET imagen_path = 'uploads/images/' || basename(imagen_path)
+                WHERE substr(imagen_path, 1, 1) = '/' OR instr(imagen_path, ?) > 0
+            ''', (base_dir,))
+            updates_imagen = cursor.rowcount
+            cursor = conn.execute('''
+                UPDATE analisis_ia
+                SET audio_path = 'uploads/audio/' || basename(audio_path)
+                WHERE substr(audio_path, 1, 1) = '/' OR instr(audio_path, ?) > 0
+            ''', (base_dir,))
+            updates_audio = cursor.rowcount
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        print(f"✅ Normalización de rutas en DB completada. Rutas actualizadas: "
+              f"{updates_imagen} imagen(es), {updates_audio} audio(s)")
     except Exception as e:
         print(f"⚠️ Error normalizando rutas en DB: {e}")
 
 def evaluar_estado(temperatura: float, luz: float) -> str:
-    if temperatura >= UMBRALES["temp_peligro"] or luz >= UMBRALES["luz_peligro"]:
-        return "Peligro"
-
-    if temperatura >= UMBRALES["temp_alerta"] or luz >= UMBRALES["luz_alerta"]:
-        return "Alerta"
-
-    return "Normal"
+    temp_alerta, temp_peligro, luz_alerta, luz_peligro = UMBRALES_ACTIVOS
+    # 2 si se supera algún umbral de peligro, si no 1 si se supera alguno
+    # de alerta, si no 0
+    nivel = max(
+        2 * (temperatura >= temp_peligro or luz >= luz_peligro),
+        temperatura >= temp_alerta or luz >= luz_alerta
+    )
+    return ESTADOS[nivel]
 
 def solicitar_captura_automatica():
     try:
@@ -355,7 +631,8 @@ def solicitar_captura_automatica():
             timeout=2
         )
 
-        if response.status_code == 200:
+        # 202: la cámara capturó y sube en segundo plano
+        if response.status_code in (200, 202):
             print(f"✓ Comando de captura enviado exitosamente")
             print(f"   La cámara capturará foto y audio automáticamente")
             return True
@@ -377,80 +654,367 @@ def solicitar_captura_automatica():
         print(f"✗ Error al solicitar captura: {e}")
         return False
 
-def guardar_lectura_sensores(datos: DatosSensores, estado: str):
-    conn = sqlite3.connect('fire_detection.db')
-    cursor = conn.cursor()
-
-    timestamp = datetime.now().isoformat()
-    cursor.execute('''
-        INSERT INTO lecturas_sensores (timestamp, temperatura, luz, humedad, presion, estado)
-        VALUES (?, ?, ?, ?, ?, ?)
-    ''', (timestamp, datos.temperatura, datos.luz, datos.humedad, datos.presion, estado))
-
-    conn.commit()
-    conn.close()
-
-def registrar_evento(tipo: str, descripcion: str, datos_extra: dict = None):
-    conn = sqlite3.connect('fire_detection.db')
-    cursor = conn.cursor()
-
-    timestamp = datetime.now().isoformat()
-    datos_json = json.dumps(datos_extra) if datos_extra else None
-
-    cursor.execute('''
+# Marca de tiempo ISO reutilizada durante VIGENCIA_AHORA segundos: las
+# lecturas y eventos no necesitan más precisión
+VIGENCIA_AHORA = 0.1
+CACHE_AHORA = (float("-inf"), "")
+
+def ahora_iso() -> str:
+    """datetime.now().isoformat(), recalculado como mucho cada VIGENCIA_AHORA s"""
+    global CACHE_AHORA
+    instante, texto = CACHE_AHORA
+    t = time.monotonic()
+    if t - instante > VIGENCIA_AHORA:
+        texto = datetime.now().isoformat()
+        CACHE_AHORA = (t, texto)
+    return texto
+
+@lru_cache(maxsize=2)
+def ruta_log_eventos(fecha: str) -> Path:
+    """Archivo de log de eventos del día `fecha` (YYYY-MM-DD)"""
+    return LOGS_DIR / f"eventos_{fecha}.log"
+
+def guardar_lectura_sensores(datos: Union[DatosSensores, LecturaSensores], estado: str):
+    """Encola la lectura; hilo_volcado_lecturas la inserta en el próximo lote"""
+    timestamp = ahora_iso()
+    LECTURAS_PENDIENTES.append(
+        (timestamp, datos.temperatura, datos.luz, datos.humedad, datos.presion, estado)
+    )
+    # Una lectura de peligro se guarda ya, sin esperar al próximo volcado
+    if estado == "Peligro" or len(LECTURAS_PENDIENTES) >= LOTE_LECTURAS:
+        EVENTO_VOLCADO.set()
+
+def registrar_evento(tipo: str, descripcion: str, datos_extra: dict = None,
+                     timestamp: Optional[str] = None):
+    if timestamp is None:
+        timestamp = ahora_iso()
+    datos_json = dumps_texto(datos_extra) if datos_extra else None
+
+    ejecutar_db('''
         INSERT INTO eventos (timestamp, tipo_evento, descripcion, datos_json)
         VALUES (?, ?, ?, ?)
     ''', (timestamp, tipo, descripcion, datos_json))
 
-    conn.commit()
-    conn.close()
-
-    log_file = LOGS_DIR / f"eventos_{datetime.now().strftime('%Y-%m-%d')}.log"
+    # Los 10 primeros caracteres del ISO son la fecha del día
+    log_file = ruta_log_eventos(timestamp[:10])
     with open(log_file, 'a') as f:
         f.write(f"[{timestamp}] {tipo}: {descripcion}\n")
 
-def guardar_imagen_base64(imagen_base64: str) -> str:
-    if ',' in imagen_base64:
-        imagen_base64 = imagen_base64.split(',')[1]
-
-    imagen_bytes = base64.b64decode(imagen_base64)
+# Caracteres base64 decodificados por bloque (múltiplo de 4: cada bloque
+# es un grupo completo de cuartetos)
+BLOQUE_BASE64 = 65536
 
+def escribir_base64(ruta: str, datos_base64: str, conservar: bool = False) -> Optional[bytearray]:
+    """
+    Decodifica base64 (con o sin prefijo data URI) directo al archivo por
+    bloques. Con `conservar` también retorna el contenido decodificado
+    """
+    contenido = bytearray() if conservar else None
+    inicio = datos_base64.find(',') + 1
+    # Base64 con saltos de línea (estilo MIME) desalinea los cuartetos de
+    # los bloques: se quitan los espacios antes de partirlo
+    if any(datos_base64.find(c, inicio) != -1 for c in " \t\r\n"):
+        datos_base64 = "".join(datos_base64[inicio:].split())
+        inicio = 0
+    with open(ruta, 'wb') as f:
+        for i in range(inicio, len(datos_base64), BLOQUE_BASE64):
+            bloque = binascii.a2b_base64(datos_base64[i:i + BLOQUE_BASE64])
+            f.write(bloque)
+            if contenido is not None:
+                contenido += bloque
+    return contenido
+
+def guardar_imagen_base64(imagen_base64: str) -> Tuple[str, bytearray]:
+    """Guarda la imagen y retorna su ruta relativa y sus bytes (para la IA)"""
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
     filename = f"captura_{timestamp}.jpg"
-    filepath = IMAGES_DIR / filename
-
-    with open(filepath, 'wb') as f:
-        f.write(imagen_bytes)
+    imagen_bytes = escribir_base64(IMAGES_DIR_STR + filename, imagen_base64, conservar=True)
 
-    return f"uploads/images/{filename}"
+    return IMAGES_REL + filename, imagen_bytes
 
 def guardar_audio_base64(audio_base64: str) -> str:
-    if ',' in audio_base64:
-        audio_base64 = audio_base64.split(',')[1]
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    filename = f"audio_{timestamp}.wav"
+    escribir_base64(AUDIO_DIR_STR + filename, audio_base64)
+
+    return AUDIO_REL + filename
 
-    audio_bytes = base64.b64decode(audio_base64)
+# Extensiones aceptadas del nombre que envía el cliente. Los archivos se
+# sirven desde /uploads, así que un .html o .svg permitiría XSS almacenado
+EXTENSIONES_IMAGEN = frozenset({".jpg", ".jpeg", ".png"})
+EXTENSIONES_AUDIO = frozenset({".m4a", ".wav", ".ogg", ".3gp"})
+
+def guardar_upload(archivo: UploadFile, directorio: Path, prefijo: str, extension: str,
+                   permitidas: frozenset, conservar: bool = False) -> Tuple[str, Optional[bytearray]]:
+    """
+    Copia un archivo multipart a disco por bloques y retorna su ruta
+    relativa. La extensión del cliente solo se usa si está en `permitidas`;
+    si no, se usa `extension`. Con `conservar` también retorna el contenido
+    copiado
+    """
+    sufijo = Path(archivo.filename or "").suffix.lower()
+    if sufijo not in permitidas:
+        sufijo = extension
 
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    filename = f"audio_{timestamp}.wav"
-    filepath = AUDIO_DIR / filename
+    filename = f"{prefijo}_{timestamp}{sufijo}"
+    filepath = directorio / filename
 
+    contenido = None
     with open(filepath, 'wb') as f:
-        f.write(audio_bytes)
+        if conservar:
+            contenido = bytearray()
+            for bloque in iter(lambda: archivo.file.read(65536), b''):
+                f.write(bloque)
+                contenido += bloque
+        else:
+            shutil.copyfileobj(archivo.file, f)
+
+    return f"uploads/{directorio.name}/{filename}", contenido
+
+def analizar_captura(imagen_path: str, audio_path: Optional[str],
+                     imagen_bytes: Optional[bytearray] = None) -> dict:
+    """
+    Analiza con IA una captura ya guardada en disco, registra el resultado
+    y decide si hay fuego. Común a los endpoints de subida.
+    Si se pasan `imagen_bytes`, la IA los usa en lugar de releer el archivo.
+    """
+    # Actualizar estado
+    ESTADO_SISTEMA["ultima_foto"] = imagen_path
+    ESTADO_SISTEMA["requiere_captura"] = False
+
+    # El evento de captura se registra junto con el análisis, pero con la
+    # hora de llegada
+    timestamp_captura = ahora_iso()
+
+    # EJECUTAR ANÁLISIS CON IA
+    print("🤖 Analizando imagen con IA...")
+    imagen_sha256 = None
+    if imagen_bytes:
+        resultado_ia, imagen_sha256 = predecir_fuego_con_cache(imagen_bytes)
+    else:
+        resultado_ia = predecir_fuego(imagen_path)
+
+    # DECISIÓN FINAL
+    fuego_confirmado = resultado_ia["fuego_detectado"] and resultado_ia["confianza"] > 0.75
+
+    # Evento de captura, resultado del análisis y evento de la decisión en
+    # una sola transacción: un único commit en el WAL
+    with transaccion_db():
+        registrar_evento(
+            "CAPTURA_RECIBIDA",
+            "Foto y audio recibidos del smartphone",
+            {"imagen": imagen_path, "audio": audio_path},
+            timestamp=timestamp_captura
+        )
+
+        ejecutar_db('''
+            INSERT INTO analisis_ia (timestamp, imagen_path, audio_path, fuego_detectado, confianza, datos_sensores, imagen_sha256)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', (
+            datetime.now().isoformat(),
+            imagen_path,
+            audio_path,
+            1 if resultado_ia["fuego_detectado"] else 0,
+            resultado_ia["confianza"],
+            ultima_lectura_json(),
+            imagen_sha256
+        ))
+
+        if fuego_confirmado:
+            registrar_evento(
+                "FUEGO_CONFIRMADO",
+                f"IA confirmó presencia de fuego (confianza: {resultado_ia['confianza']:.2%})",
+                resultado_ia
+            )
+        else:
+            registrar_evento(
+                "FALSA_ALARMA",
+                f"IA descartó presencia de fuego (confianza: {resultado_ia['confianza']:.2%})",
+                resultado_ia
+            )
+
+    if fuego_confirmado:
+        # ¡FUEGO CONFIRMADO!
+        ESTADO_SISTEMA["estado_actual"] = "Fuego_Confirmado"
+        ESTADO_SISTEMA["ultimo_analisis_ia"] = resultado_ia
+
+        print(f"🔥 ¡FUEGO CONFIRMADO! Confianza: {resultado_ia['confianza']:.2%}")
+
+        # Enviar notificación por Telegram solo cuando la IA confirma fuego
+        # La función espera porcentaje (0-100)
+        notificar_en_segundo_plano(resultado_ia['confianza'] * 100, imagen_path)
+
+        # TODO: Enviar notificaciones (WhatsApp, Email)
+
+        return {
+            "status": "fuego_confirmado",
+            "mensaje": "¡FUEGO DETECTADO!",
+            "confianza": resultado_ia["confianza"],
+            "imagen_guardada": imagen_path,
+            "audio_guardado": audio_path
+        }
+    else:
+        # Falsa alarma
+        ESTADO_SISTEMA["estado_actual"] = "Normal"
+        ESTADO_SISTEMA["ultimo_analisis_ia"] = resultado_ia
+
+        print(f"✅ Falsa alarma - No se detectó fuego (confianza: {resultado_ia['confianza']:.2%})")
+
+        return {
+            "status": "falsa_alarma",
+            "mensaje": "No se detectó fuego",
+            "confianza": resultado_ia["confianza"],
+            "imagen_guardada": imagen_path,
+            "audio_guardado": audio_path
+        }
+
 
-    return f"uploads/audio/{filename}"
 
 MODEL = None
 MODEL_TYPE = None
 MODEL_INPUT_SHAPE = (224, 224)
-
+# Se preparan una sola vez al cargar el modelo y se reutilizan en cada lote:
+# los píxeles RGB (lote, alto, ancho, 3) en uint8 y el tensor de entrada
+# (lote, alto, ancho, 3) en float32
+MODEL_PIXELS_BUFFER = None
+MODEL_INPUT_BUFFER = None
+# Modelo Keras envuelto en un tf.function (compilado con XLA si se puede):
+# evita el bucle genérico de MODEL.predict en cada lote
+MODEL_PREDICT = None
+# Datos del interpreter TFLite leídos una vez en cargar_modelo_ia:
+# índices de los tensores, tipo de entrada y cuantización (escala, cero)
+TFLITE_INPUT_INDEX = None
+TFLITE_OUTPUT_INDEX = None
+TFLITE_INPUT_DTYPE = None
+TFLITE_INPUT_SCALE = 0.0
+TFLITE_INPUT_ZP = 0
+TFLITE_OUTPUT_SCALE = 0.0
+TFLITE_OUTPUT_ZP = 0
+# Entrada entera con otra cuantización: q = píxel * MUL + ADD, que funde
+# la normalización /255 con la división por la escala en un solo producto
+TFLITE_PREPROC_MUL = 0.0
+TFLITE_PREPROC_ADD = 0.0
+# Entrada cuantizada como x / 255 (uint8 con cero 0 o int8 con cero -128):
+# los píxeles se pasan sin pasar por float
+TFLITE_ENTRADA_DIRECTA = False
+# Tamaño de lote para el que está reservado el interpreter; False si el
+# modelo no admite cambiar la dimensión de lote (se invoca imagen a imagen)
+TFLITE_LOTE_ACTUAL = 1
+TFLITE_ADMITE_LOTES = True
+
+# Micro-lotes: las inferencias pendientes (subidas HTTP de varias cámaras y
+# fotos MQTT) se agrupan hasta LOTE_INFERENCIA_MAX imágenes o ESPERA_LOTE
+# segundos y se resuelven con una sola llamada al modelo. Solo el hilo de
+# inferencia toca el modelo y los buffers, así que no hace falta un lock
+LOTE_INFERENCIA_MAX = 8
+ESPERA_LOTE = 0.05
+COLA_INFERENCIA = queue.SimpleQueue()
+hilo_inferencia = None
+hilo_inferencia_lock = threading.Lock()
+
+# Hilos donde los endpoints de subida ejecutan analizar_captura, fuera del
+# event loop de FastAPI. Caben tantos como imágenes por lote para que las
+# subidas simultáneas puedan agruparse en la misma inferencia
+INFERENCE_POOL = ThreadPoolExecutor(max_workers=LOTE_INFERENCIA_MAX,
+                                    thread_name_prefix="inferencia")
+
+def preparar_buffer_entrada():
+    """Reserva MODEL_PIXELS_BUFFER y MODEL_INPUT_BUFFER para un lote completo"""
+    global MODEL_PIXELS_BUFFER, MODEL_INPUT_BUFFER
+    ancho, alto = MODEL_INPUT_SHAPE
+    MODEL_PIXELS_BUFFER = np.empty((LOTE_INFERENCIA_MAX, alto, ancho, 3), dtype=np.uint8)
+    MODEL_INPUT_BUFFER = np.empty((LOTE_INFERENCIA_MAX, alto, ancho, 3), dtype=np.float32)
+
+
+# Modelos TFLite en orden de preferencia según la CPU (ver
+# quantize_fire_model.py). En ARM los kernels int8 usan instrucciones de
+# producto punto y son los más rápidos; en x86 XNNPACK no acelera int8 y
+# conviene float16 (pesos a la mitad, cómputo en float). TFLite se prueba
+# antes que el modelo Keras .h5, que es más lento y pesado en CPU
+if platform.machine().lower() in ('aarch64', 'arm64') or platform.machine().lower().startswith('arm'):
+    TFLITE_MODEL_FILES = ('fire_model_int8.tflite', 'fire_model_fp16.tflite', 'fire_model.tflite')
+else:
+    TFLITE_MODEL_FILES = ('fire_model_fp16.tflite', 'fire_model.tflite', 'fire_model_int8.tflite')
+
+def compilar_prediccion_keras(tf, modelo):
+    """
+    Devuelve un tf.function que ejecuta el modelo sobre un lote float32.
+    Se prueba primero con XLA (jit_compile) y una inferencia de
+    calentamiento; si XLA no está disponible se usa el grafo sin compilar
+    """
+    alto, ancho = MODEL_INPUT_SHAPE[1], MODEL_INPUT_SHAPE[0]
+    firma = [tf.TensorSpec((None, alto, ancho, 3), tf.float32)]
+    for jit in (True, False):
+        predecir = tf.function(lambda x: modelo(x, training=False),
+                               jit_compile=jit, input_signature=firma)
+        try:
+            predecir(np.zeros((1, alto, ancho, 3), dtype=np.float32))
+            return predecir
+        except Exception as e:
+            print(f"⚠️ No se pudo compilar el modelo Keras (jit_compile={jit}): {e}")
+    return None
 
 def cargar_modelo_ia():
     global MODEL, MODEL_TYPE, MODEL_INPUT_SHAPE
+    global TFLITE_INPUT_INDEX, TFLITE_OUTPUT_INDEX, TFLITE_INPUT_DTYPE, TFLITE_INPUT_SCALE
+    global TFLITE_INPUT_ZP, TFLITE_OUTPUT_SCALE, TFLITE_OUTPUT_ZP, TFLITE_ENTRADA_DIRECTA
+    global TFLITE_PREPROC_MUL, TFLITE_PREPROC_ADD
+    global TFLITE_LOTE_ACTUAL, TFLITE_ADMITE_LOTES, MODEL_PREDICT
+
+    try:
+        tflite_model_path = next(
+            (MODELS_DIR / nombre for nombre in TFLITE_MODEL_FILES if (MODELS_DIR / nombre).exists()),
+            None
+        )
+        if tflite_model_path is not None:
+            try:
+                import tflite_runtime.interpreter as tflite
+                Interpreter = tflite.Interpreter
+            except ImportError:
+                # Sin tflite-runtime: usar el interpreter incluido en TensorFlow
+                import tensorflow as tf
+                Interpreter = tf.lite.Interpreter
+
+            print(f"🔁 Cargando modelo TFLite desde {tflite_model_path}")
+            interpreter = Interpreter(model_path=str(tflite_model_path),
+                                      num_threads=os.cpu_count())
+            interpreter.allocate_tensors()
+            MODEL = interpreter
+            MODEL_TYPE = 'tflite'
+            TFLITE_LOTE_ACTUAL = 1
+            TFLITE_ADMITE_LOTES = True
+            input_details = interpreter.get_input_details()[0]
+            output_details = interpreter.get_output_details()[0]
+            TFLITE_INPUT_INDEX = input_details['index']
+            TFLITE_OUTPUT_INDEX = output_details['index']
+            TFLITE_INPUT_DTYPE = input_details['dtype']
+            TFLITE_INPUT_SCALE, TFLITE_INPUT_ZP = input_details.get('quantization', (0.0, 0))
+            TFLITE_OUTPUT_SCALE, TFLITE_OUTPUT_ZP = output_details.get('quantization', (0.0, 0))
+            TFLITE_ENTRADA_DIRECTA = (abs(TFLITE_INPUT_SCALE * 255.0 - 1.0) < 1e-3
+                                      and ((TFLITE_INPUT_DTYPE == np.uint8 and TFLITE_INPUT_ZP == 0)
+                                           or (TFLITE_INPUT_DTYPE == np.int8 and TFLITE_INPUT_ZP == -128)))
+            if TFLITE_INPUT_SCALE:
+                TFLITE_PREPROC_MUL = 1.0 / (255.0 * TFLITE_INPUT_SCALE)
+                TFLITE_PREPROC_ADD = float(TFLITE_INPUT_ZP)
+            try:
+                shape = input_details['shape']
+                if len(shape) >= 3:
+                    MODEL_INPUT_SHAPE = (int(shape[1]), int(shape[2]))
+            except Exception:
+                pass
+            preparar_buffer_entrada()
+            print(f"✅ Modelo TFLite cargado correctamente (entrada {TFLITE_INPUT_DTYPE.__name__})")
+            return MODEL
+    except Exception as e:
+        print(f"⚠️ No se pudo cargar TFLite: {e}")
 
+    # TensorFlow (segundos de arranque y cientos de MB) solo se importa si
+    # hay que cargar el modelo .h5
     try:
-        import tensorflow as tf
         keras_model_path = MODELS_DIR / 'fire_model.h5'
         if keras_model_path.exists():
+            import tensorflow as tf
             print(f"🔁 Cargando modelo Keras desde {keras_model_path}")
             MODEL = tf.keras.models.load_model(str(keras_model_path))
             try:
@@ -460,140 +1024,318 @@ def cargar_modelo_ia():
             except Exception:
                 pass
             MODEL_TYPE = 'keras'
+            preparar_buffer_entrada()
+            MODEL_PREDICT = compilar_prediccion_keras(tf, MODEL)
             print("✅ Modelo Keras cargado correctamente")
             return MODEL
     except Exception as e:
         print(f"⚠️ No se pudo cargar TensorFlow/Keras o modelo .h5 no encontrado: {e}")
 
-    try:
-        try:
-            import tflite_runtime.interpreter as tflite
-            Interpreter = tflite.Interpreter
-        except Exception:
-            import tensorflow as tf
-            Interpreter = tf.lite.Interpreter
-
-        tflite_model_path = MODELS_DIR / 'fire_model.tflite'
-        if tflite_model_path.exists():
-            print(f"🔁 Cargando modelo TFLite desde {tflite_model_path}")
-            interpreter = Interpreter(model_path=str(tflite_model_path))
-            interpreter.allocate_tensors()
-            MODEL = interpreter
-            MODEL_TYPE = 'tflite'
-            try:
-                input_details = interpreter.get_input_details()
-                shape = input_details[0]['shape']
-                if len(shape) >= 3:
-                    MODEL_INPUT_SHAPE = (int(shape[1]), int(shape[2]))
-            except Exception:
-                pass
-            print("✅ Modelo TFLite cargado correctamente")
-            return MODEL
-    except Exception as e:
-        print(f"⚠️ No se pudo cargar TFLite: {e}")
-
     MODEL = None
     MODEL_TYPE = None
     print("⚠️ No se encontró ningún modelo IA. Usando heurística de color como fallback.")
     return None
 
-def predecir_fuego(imagen_path: str) -> dict:
-    global MODEL, MODEL_TYPE, MODEL_INPUT_SHAPE
+# Marcadores SOF (inicio de frame) de JPEG: C0-CF salvo DHT (C4), JPG (C8)
+# y DAC (CC). Contienen el alto y el ancho de la imagen
+MARCADORES_SOF = frozenset(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+def dimensiones_jpeg(datos) -> Optional[Tuple[int, int]]:
+    """(ancho, alto) leídos de la cabecera de un JPEG sin decodificarlo; None si no es JPEG"""
+    if bytes(datos[:2]) != b'\xff\xd8':
+        return None
+    i = 2
+    n = len(datos)
+    while i + 9 < n:
+        if datos[i] != 0xFF:
+            return None
+        marcador = datos[i + 1]
+        if marcador == 0xFF:
+            # Relleno entre marcadores
+            i += 1
+            continue
+        if marcador == 0x01 or 0xD0 <= marcador <= 0xD8:
+            # Marcadores sin segmento de datos
+            i += 2
+            continue
+        if marcador in MARCADORES_SOF:
+            alto = (datos[i + 5] << 8) | datos[i + 6]
+            ancho = (datos[i + 7] << 8) | datos[i + 8]
+            return ancho, alto
+        i += 2 + ((datos[i + 2] << 8) | datos[i + 3])
+    return None
 
-    try:
-        img_path = imagen_path
-        if not os.path.isabs(img_path):
-            candidate = BASE_DIR / img_path
-            if candidate.exists():
-                img_path = str(candidate)
+# Decodificación JPEG reducida: libjpeg escala los bloques DCT a 1/2, 1/4 u
+# 1/8 al decodificar, sin crear el bitmap a resolución completa. Se usa el
+# mayor factor que deja la imagen al menos del tamaño que necesitan el
+# modelo y la heurística
+LECTURA_REDUCIDA = ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4),
+                    (2, cv2.IMREAD_REDUCED_COLOR_2)) if cv2 is not None else ()
+
+def modo_lectura_imagen(datos) -> int:
+    """Flag de cv2.imdecode para decodificar `datos` al menor tamaño útil"""
+    dimensiones = dimensiones_jpeg(datos)
+    if dimensiones is None:
+        return cv2.IMREAD_COLOR
+    # Lado mínimo: la foto puede venir rotada (EXIF), así que se compara el
+    # lado más corto con el mayor de los tamaños pedidos
+    lado_minimo = max(MODEL_INPUT_SHAPE + HEURISTICA_TAMANO)
+    lado_corto = min(dimensiones)
+    for factor, modo in LECTURA_REDUCIDA:
+        if lado_corto // factor >= lado_minimo:
+            return modo
+    return cv2.IMREAD_COLOR
+
+def cargar_imagen_bgr(fuente):
+    """
+    Decodifica con OpenCV (BGR) una ruta de imagen o sus bytes ya en memoria.
+    Los JPEG grandes se decodifican directamente a escala reducida
+    """
+    if cv2 is None:
+        raise RuntimeError("OpenCV/numpy no están instalados")
+    if not isinstance(fuente, (bytes, bytearray, memoryview)):
+        with open(fuente, 'rb') as f:
+            fuente = f.read()
+    img = cv2.imdecode(np.frombuffer(fuente, dtype=np.uint8), modo_lectura_imagen(fuente))
+    if img is None:
+        raise ValueError("No se pudo decodificar la imagen")
+    return img
+
+def encolar_inferencia(pixeles) -> Future:
+    """Encola una imagen ya redimensionada (BGR) y devuelve el Future con su probabilidad"""
+    global hilo_inferencia
+    futuro = Future()
+    COLA_INFERENCIA.put((pixeles, futuro))
+    if hilo_inferencia is None:
+        with hilo_inferencia_lock:
+            if hilo_inferencia is None:
+                hilo_inferencia = threading.Thread(target=ejecutar_inferencias,
+                                                   name="inferencia_ia", daemon=True)
+                hilo_inferencia.start()
+    return futuro
+
+def ejecutar_inferencias():
+    """Hilo que agrupa las imágenes pendientes y las infiere por lotes"""
+    while True:
+        lote = [COLA_INFERENCIA.get()]
+        limite = time.monotonic() + ESPERA_LOTE
+        while len(lote) < LOTE_INFERENCIA_MAX:
+            restante = limite - time.monotonic()
+            if restante <= 0:
+                break
+            try:
+                lote.append(COLA_INFERENCIA.get(timeout=restante))
+            except queue.Empty:
+                break
+
+        try:
+            probs = inferir_lote([pixeles for pixeles, _ in lote])
+        except Exception as e:
+            for _, futuro in lote:
+                futuro.set_exception(e)
+            continue
+        for (_, futuro), prob in zip(lote, probs):
+            futuro.set_result(prob)
+
+def invocar_tflite(input_data):
+    """Ejecuta el interpreter TFLite sobre un lote, ajustando su tamaño si cambia"""
+    global TFLITE_LOTE_ACTUAL, TFLITE_ADMITE_LOTES
+    interpreter = MODEL
+    n = input_data.shape[0]
+    if n != TFLITE_LOTE_ACTUAL:
+        interpreter.resize_tensor_input(TFLITE_INPUT_INDEX, list(input_data.shape))
+        interpreter.allocate_tensors()
+        TFLITE_LOTE_ACTUAL = n
+    interpreter.set_tensor(TFLITE_INPUT_INDEX, input_data)
+    interpreter.invoke()
+    return interpreter.get_tensor(TFLITE_OUTPUT_INDEX)
+
+def inferir_lote(imagenes: List) -> List[float]:
+    """Inferencia de un lote de imágenes BGR redimensionadas; devuelve la probabilidad de fuego de cada una"""
+    global TFLITE_ADMITE_LOTES, TFLITE_LOTE_ACTUAL
+    if MODEL_INPUT_BUFFER is None:
+        preparar_buffer_entrada()
+
+    n = len(imagenes)
+    # Copiar cada imagen al lote invirtiendo BGR -> RGB en la misma copia
+    for i, pixeles in enumerate(imagenes):
+        MODEL_PIXELS_BUFFER[i] = pixeles[:, :, ::-1]
+    rgb = MODEL_PIXELS_BUFFER[:n]
+
+    if MODEL_TYPE == 'keras':
+        # Normalización a [0, 1] directamente sobre el buffer reservado
+        np.divide(rgb, 255.0, out=MODEL_INPUT_BUFFER[:n])
+        if MODEL_PREDICT is not None:
+            preds = MODEL_PREDICT(MODEL_INPUT_BUFFER[:n]).numpy()
+        else:
+            preds = MODEL.predict(MODEL_INPUT_BUFFER[:n], verbose=0)
+    else:
+        if TFLITE_ENTRADA_DIRECTA:
+            if TFLITE_INPUT_DTYPE == np.uint8:
+                # Modelo cuantizado uint8: los píxeles ya son la entrada
+                input_data = rgb
             else:
-                candidate2 = IMAGES_DIR / os.path.basename(img_path)
-                if candidate2.exists():
-                    img_path = str(candidate2)
-        if not os.path.exists(img_path):
-            raise FileNotFoundError(f"Archivo de imagen no encontrado: {img_path}")
+                # int8 con cero -128: p - 128 es p con el bit alto invertido
+                # leído como int8, sin pasar por int16 ni float
+                np.bitwise_xor(rgb, 0x80, out=rgb)
+                input_data = rgb.view(np.int8)
+        elif TFLITE_INPUT_DTYPE in (np.uint8, np.int8) and TFLITE_INPUT_SCALE:
+            # Otros modelos cuantizados que esperan enteros: una sola
+            # transformación afín desde los píxeles, sobre el buffer reservado
+            input_data = MODEL_INPUT_BUFFER[:n]
+            np.multiply(rgb, TFLITE_PREPROC_MUL, out=input_data)
+            input_data += TFLITE_PREPROC_ADD
+            np.rint(input_data, out=input_data)
+            limites = np.iinfo(TFLITE_INPUT_DTYPE)
+            np.clip(input_data, limites.min, limites.max, out=input_data)
+            input_data = input_data.astype(TFLITE_INPUT_DTYPE)
+        else:
+            np.divide(rgb, 255.0, out=MODEL_INPUT_BUFFER[:n])
+            input_data = MODEL_INPUT_BUFFER[:n]
+
+        preds = None
+        if TFLITE_ADMITE_LOTES and n > 1:
+            try:
+                preds = invocar_tflite(input_data)
+            except Exception as e:
+                print(f"⚠️ El modelo TFLite no admite lotes, se infiere imagen a imagen: {e}")
+                TFLITE_ADMITE_LOTES = False
+                # Forzar que el interpreter vuelva a reservarse para lote 1
+                TFLITE_LOTE_ACTUAL = 0
+        if preds is None:
+            preds = np.concatenate([invocar_tflite(input_data[i:i + 1]) for i in range(n)])
+
+        # Salida cuantizada: volver a probabilidades en [0, 1]
+        if TFLITE_OUTPUT_SCALE and np.issubdtype(preds.dtype, np.integer):
+            preds = (preds.astype(np.float32) - TFLITE_OUTPUT_ZP) * TFLITE_OUTPUT_SCALE
+
+    # Asumimos clasificador binario que devuelve probabilidad de clase 'fuego'
+    # El modelo puede retornar una matriz (batch,1) o (batch,2). Se acota a
+    # [0, 1] todo el lote de una vez y tolist() devuelve floats de Python
+    columna = 1 if preds.ndim == 2 and preds.shape[1] == 2 else 0
+    return np.clip(preds[:, columna], 0.0, 1.0).tolist()
+
+def resolver_ruta_imagen(imagen_path: str) -> str:
+    """
+    Resuelve rutas relativas (uploads/images/...) a un archivo existente.
+    En el caso habitual (ruta absoluta o relativa a BASE_DIR) basta un stat
+    """
+    img_path = imagen_path if os.path.isabs(imagen_path) else str(BASE_DIR / imagen_path)
+    if os.path.isfile(img_path):
+        return img_path
+    candidate = str(IMAGES_DIR / os.path.basename(imagen_path))
+    if os.path.isfile(candidate):
+        return candidate
+    raise FileNotFoundError(f"Archivo de imagen no encontrado: {img_path}")
+
+# Umbral mínimo del canal rojo para la heurística de color y margen mínimo
+# de R sobre G (aproxima la saturación: descarta blancos, beige y piel)
+HEURISTICA_ROJO_MIN = 180
+HEURISTICA_MARGEN_RG = 20
+# Tamaño al que se reduce la foto antes de la heurística: la proporción de
+# píxeles de fuego se conserva al escalar y hay muchos menos que recorrer
+HEURISTICA_TAMANO = (256, 256)
+
+def predecir_fuego(imagen_path: Union[str, bytes, bytearray, memoryview]) -> dict:
+    """
+    Analiza una imagen con el modelo IA (o la heurística de color).
+    Acepta la ruta de la imagen o sus bytes: el flujo MQTT ya tiene la foto
+    en memoria y así no se vuelve a leer del disco.
+    """
+    return analizar_imagen(imagen_path)[0]
+
+def analizar_imagen(imagen_path: Union[str, bytes, bytearray, memoryview]) -> Tuple[dict, bool]:
+    """
+    Cuerpo de predecir_fuego. Devuelve (resultado, completo): completo es
+    False si hubo algún error (ruta, decodificación, modelo o heurística) y
+    el resultado es el valor por defecto o la heurística de respaldo, que no
+    deben reutilizarse para la misma imagen
+    """
+
+    try:
+        if isinstance(imagen_path, (bytes, bytearray, memoryview)):
+            img_path = imagen_path
+        else:
+            img_path = resolver_ruta_imagen(imagen_path)
     except Exception as e:
         print(f"⚠️ predecir_fuego: error resolviendo ruta de imagen: {e}")
-        return {"fuego_detectado": False, "confianza": 0.0}
+        return {"fuego_detectado": False, "confianza": 0.0}, False
 
     try:
-        from PIL import Image
-        import numpy as np
-
-        if MODEL and MODEL_TYPE == 'keras':
-            # Preprocesar imagen según tamaño del modelo
-            img = Image.open(img_path).convert('RGB')
-            img_resized = img.resize(MODEL_INPUT_SHAPE)
-            arr = np.asarray(img_resized).astype('float32') / 255.0
-            batch = np.expand_dims(arr, axis=0)
-            preds = MODEL.predict(batch)
-            # Asumimos clasificador binario que devuelve probabilidad de clase 'fuego'
-            # TensorFlow puede retornar una matriz (batch,1) o (batch,2)
-            if preds.ndim == 2 and preds.shape[1] == 2:
-                prob = float(preds[0,1])
-            else:
-                prob = float(preds[0,0])
-            fuego = prob >= 0.5
-            return {"fuego_detectado": bool(fuego), "confianza": max(0.0, min(1.0, prob))}
-
-        elif MODEL and MODEL_TYPE == 'tflite':
-            # Usar el interpreter TFLite
-            import numpy as np
-            from PIL import Image
-            interpreter = MODEL
-            input_details = interpreter.get_input_details()
-            output_details = interpreter.get_output_details()
-
-            img = Image.open(img_path).convert('RGB')
-            img_resized = img.resize(MODEL_INPUT_SHAPE)
-            arr = np.asarray(img_resized).astype('float32') / 255.0
-            input_data = np.expand_dims(arr, axis=0)
-
-            # Algunos modelos TFLite esperan uint8
-            if input_details[0]['dtype'] == np.uint8:
-                input_scale, input_zero_point = input_details[0].get('quantization', (1.0, 0))
-                if input_scale and input_zero_point is not None:
-                    input_data = (input_data / input_scale + input_zero_point).astype(np.uint8)
-
-            interpreter.set_tensor(input_details[0]['index'], input_data)
-            interpreter.invoke()
-            output_data = interpreter.get_tensor(output_details[0]['index'])
-            # Interpretar salida similar a Keras
-            if output_data.ndim == 2 and output_data.shape[1] == 2:
-                prob = float(output_data[0,1])
-            else:
-                prob = float(output_data[0,0])
-            fuego = prob >= 0.5
-            return {"fuego_detectado": bool(fuego), "confianza": max(0.0, min(1.0, prob))}
+        img = cargar_imagen_bgr(img_path)
+    except Exception as e:
+        print(f"⚠️ predecir_fuego: error decodificando imagen: {e}")
+        return {"fuego_detectado": False, "confianza": 0.0}, False
+
+    completo = True
+    try:
+        if MODEL and MODEL_TYPE in ('keras', 'tflite'):
+            # Preprocesar en este hilo (OpenCV libera el GIL) y esperar el
+            # resultado del lote en el que entre la imagen
+            pixeles = cv2.resize(img, MODEL_INPUT_SHAPE, interpolation=cv2.INTER_AREA)
+            prob = encolar_inferencia(pixeles).result()
+            return {"fuego_detectado": prob >= 0.5, "confianza": prob}, True
 
     except Exception as e:
         print(f"⚠️ Error durante inferencia con modelo IA: {e}")
         # Caer a heurística abajo
+        completo = False
 
     # Fallback heurístico basado en color (útil para pruebas sin modelo)
     try:
-        from PIL import Image
-        import numpy as np
-
-        img = Image.open(img_path).convert('RGB')
-        arr = np.asarray(img)
-        # Convertir a HSV para detectar tonos rojizos/amarillos típicos de fuego
-        import cv2
-        hsv = cv2.cvtColor(arr, cv2.COLOR_RGB2HSV)
-        h, s, v = hsv[:, :, 0], hsv[:, :, 1], hsv[:, :, 2]
-        # Rango de hueso que puede representar fuego: 0-50 (rojos-amarillos)
-        mask = ((h <= 50) & (s >= 80) & (v >= 80))
-        ratio = float(np.sum(mask)) / (arr.shape[0] * arr.shape[1])
+        # Tonos rojizos/amarillos típicos de fuego directamente sobre BGR,
+        # sin convertir a HSV: rojo intenso, R > G + margen y G > B (mismo
+        # criterio que models/script-IA.py). Las máscaras se combinan en el
+        # mismo buffer
+        if img.shape[0] * img.shape[1] > HEURISTICA_TAMANO[0] * HEURISTICA_TAMANO[1]:
+            img = cv2.resize(img, HEURISTICA_TAMANO, interpolation=cv2.INTER_AREA)
+        b, g, r = cv2.split(img)
+        mask = cv2.compare(r, HEURISTICA_ROJO_MIN, cv2.CMP_GT)
+        mask_tmp = cv2.compare(cv2.subtract(r, g), HEURISTICA_MARGEN_RG, cv2.CMP_GT)
+        cv2.bitwise_and(mask, mask_tmp, dst=mask)
+        cv2.compare(g, b, cv2.CMP_GT, dst=mask_tmp)
+        cv2.bitwise_and(mask, mask_tmp, dst=mask)
+        ratio = cv2.countNonZero(mask) / (img.shape[0] * img.shape[1])
 
         # Mapear ratio a confianza (ajustable)
         confianza = min(1.0, ratio * 10)  # si 10% de pixeles, confianza ~1.0
         fuego = confianza >= 0.2  # umbral bajo para heurística
         print(f"🔎 Heurística de color: ratio={ratio:.4f}, confianza={confianza:.3f}")
-        return {"fuego_detectado": bool(fuego), "confianza": confianza}
+        return {"fuego_detectado": bool(fuego), "confianza": confianza}, completo
 
     except Exception as e:
         print(f"⚠️ Heurística falló: {e}")
-        return {"fuego_detectado": False, "confianza": 0.0}
+        return {"fuego_detectado": False, "confianza": 0.0}, False
+
+# Resultados de la IA por SHA-256 de la imagen: si el smartphone reenvía la
+# misma foto (red inestable, capturas repetidas) no se vuelve a inferir.
+# Solo se guardan análisis sin errores, para que un fallo puntual no quede
+# como respuesta fija. Acotado a las CACHE_PREDICCIONES_MAX fotos más recientes
+CACHE_PREDICCIONES = OrderedDict()
+CACHE_PREDICCIONES_MAX = 32
+CACHE_PREDICCIONES_LOCK = threading.Lock()
+
+def predecir_fuego_con_cache(imagen_bytes) -> Tuple[dict, str]:
+    """
+    predecir_fuego sobre los bytes de una imagen, reutilizando el resultado
+    si ya se analizó una foto idéntica. Devuelve (resultado, sha256)
+    """
+    sha256 = hashlib.sha256(imagen_bytes).hexdigest()
+    with CACHE_PREDICCIONES_LOCK:
+        resultado = CACHE_PREDICCIONES.get(sha256)
+        if resultado is not None:
+            CACHE_PREDICCIONES.move_to_end(sha256)
+    if resultado is not None:
+        print(f"♻️ Imagen repetida ({sha256[:12]}): se reutiliza el análisis previo")
+        return dict(resultado), sha256
+
+    resultado, completo = analizar_imagen(imagen_bytes)
+    if completo:
+        with CACHE_PREDICCIONES_LOCK:
+            CACHE_PREDICCIONES[sha256] = resultado
+            if len(CACHE_PREDICCIONES) > CACHE_PREDICCIONES_MAX:
+                CACHE_PREDICCIONES.popitem(last=False)
+    return dict(resultado), sha256
 
 # ============================================================================
 # ENDPOINTS DE LA API
@@ -730,7 +1472,7 @@ async def upload_multimedia(datos: UploadMultimedia):
     
     try:
         # Guardar imagen
-        imagen_path = guardar_imagen_base64(datos.imagen)
+        imagen_path, imagen_bytes = guardar_imagen_base64(datos.imagen)
         print(f"✅ Imagen guardada: {imagen_path}")
         
         # Guardar audio (si existe)
@@ -739,88 +1481,46 @@ async def upload_multimedia(datos: UploadMultimedia):
             audio_path = guardar_audio_base64(datos.audio)
             print(f"✅ Audio guardado: {audio_path}")
         
-        # Actualizar estado
-        ESTADO_SISTEMA["ultima_foto"] = imagen_path
-        ESTADO_SISTEMA["requiere_captura"] = False
-        
-        # Registrar evento
-        registrar_evento(
-            "CAPTURA_RECIBIDA",
-            "Foto y audio recibidos del smartphone",
-            {"imagen": imagen_path, "audio": audio_path}
-        )
-        
-        # EJECUTAR ANÁLISIS CON IA
-        print("🤖 Analizando imagen con IA...")
-        resultado_ia = predecir_fuego(imagen_path)
-        
-        # Guardar resultado en base de datos
-        conn = sqlite3.connect('fire_detection.db')
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT INTO analisis_ia (timestamp, imagen_path, audio_path, fuego_detectado, confianza, datos_sensores)
-            VALUES (?, ?, ?, ?, ?, ?)
-        ''', (
-            datetime.now().isoformat(),
-            imagen_path,
-            audio_path,
-            1 if resultado_ia["fuego_detectado"] else 0,
-            resultado_ia["confianza"],
-            json.dumps(ESTADO_SISTEMA["ultima_lectura"])
-        ))
-        conn.commit()
-        conn.close()
-        
-        # DECISIÓN FINAL
-        if resultado_ia["fuego_detectado"] and resultado_ia["confianza"] > 0.75:
-            # ¡FUEGO CONFIRMADO!
-            ESTADO_SISTEMA["estado_actual"] = "Fuego_Confirmado"
-            ESTADO_SISTEMA["ultimo_analisis_ia"] = resultado_ia
-            
-            registrar_evento(
-                "FUEGO_CONFIRMADO",
-                f"IA confirmó presencia de fuego (confianza: {resultado_ia['confianza']:.2%})",
-                resultado_ia
-            )
+        # Inferencia e inserción en la BD bloquean: se ejecutan en
+        # INFERENCE_POOL para no detener el resto de endpoints
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(INFERENCE_POOL, analizar_captura,
+                                          imagen_path, audio_path, imagen_bytes)
             
-            print(f"🔥 ¡FUEGO CONFIRMADO! Confianza: {resultado_ia['confianza']:.2%}")
-
-            # Enviar notificación por Telegram solo cuando la IA confirma fuego
-            try:
-                # La función espera porcentaje (0-100)
-                notificar_fuego_confirmado(resultado_ia['confianza'] * 100, imagen_url=imagen_path)
-            except Exception as e:
-                print(f"⚠️ Error al notificar por Telegram: {e}")
+    except Exception as e:
+        print(f"❌ Error procesando multimedia: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error procesando archivos: {str(e)}")
 
-            # TODO: Enviar notificaciones (WhatsApp, Email)
-            
-            return {
-                "status": "fuego_confirmado",
-                "mensaje": "¡FUEGO DETECTADO!",
-                "confianza": resultado_ia["confianza"],
-                "imagen_guardada": imagen_path,
-                "audio_guardado": audio_path
-            }
-        else:
-            # Falsa alarma
-            ESTADO_SISTEMA["estado_actual"] = "Normal"
-            ESTADO_SISTEMA["ultimo_analisis_ia"] = resultado_ia
-            
-            registrar_evento(
-                "FALSA_ALARMA",
-                f"IA descartó presencia de fuego (confianza: {resultado_ia['confianza']:.2%})",
-                resultado_ia
-            )
-            
-            print(f"✅ Falsa alarma - No se detectó fuego (confianza: {resultado_ia['confianza']:.2%})")
-            
-            return {
-                "status": "falsa_alarma",
-                "mensaje": "No se detectó fuego",
-                "confianza": resultado_ia["confianza"],
-                "imagen_guardada": imagen_path,
-                "audio_guardado": audio_path
-            }
+@app.post("/api/upload/archivos")
+async def upload_multimedia_archivos(
+    imagen: UploadFile = File(...),
+    audio: Optional[UploadFile] = File(None),
+    timestamp: str = Form(...),
+    dispositivo: Optional[str] = Form(None)
+):
+    """
+    Recibe foto y audio desde el smartphone como multipart/form-data.
+    Los archivos llegan en binario (sin base64) y se copian a disco por
+    bloques. La imagen además se conserva en memoria para la IA.
+    
+    Campos: imagen (archivo), audio (archivo, opcional), timestamp, dispositivo
+    """
+    print(f"📸 Recibiendo captura del smartphone ({timestamp}, multipart)")
+    
+    try:
+        imagen_path, imagen_bytes = guardar_upload(imagen, IMAGES_DIR, "captura", ".jpg",
+                                                    EXTENSIONES_IMAGEN, conservar=True)
+        print(f"✅ Imagen guardada: {imagen_path}")
+        
+        audio_path = None
+        if audio is not None:
+            audio_path, _ = guardar_upload(audio, AUDIO_DIR, "audio", ".wav", EXTENSIONES_AUDIO)
+            print(f"✅ Audio guardado: {audio_path}")
+        
+        # Igual que en /api/upload, fuera del event loop
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(INFERENCE_POOL, analizar_captura,
+                                          imagen_path, audio_path, imagen_bytes)
             
     except Exception as e:
         print(f"❌ Error procesando multimedia: {str(e)}")
@@ -847,6 +1547,7 @@ async def actualizar_umbrales(config: ConfigUmbrales):
         UMBRALES["luz_alerta"] = config.luz_alerta
     if config.luz_peligro is not None:
         UMBRALES["luz_peligro"] = config.luz_peligro
+    refrescar_umbrales()
     
     registrar_evento("CONFIG_UMBRALES", "Umbrales actualizados", UMBRALES)
     print(f"⚙️  Umbrales actualizados: {UMBRALES}")
@@ -864,10 +1565,7 @@ async def obtener_historico(limit: int = 100):
     Args:
         limit: Número máximo de registros a devolver (default: 100)
     """
-    conn = sqlite3.connect('fire_detection.db')
-    cursor = conn.cursor()
-    
-    cursor.execute('''
+    cursor = conexion_db().execute('''
         SELECT timestamp, temperatura, luz, humedad, presion, estado
         FROM lecturas_sensores
         ORDER BY id DESC
@@ -875,7 +1573,6 @@ async def obtener_historico(limit: int = 100):
     ''', (limit,))
     
     resultados = cursor.fetchall()
-    conn.close()
     
     historico = []
     for row in resultados:
@@ -898,10 +1595,7 @@ async def obtener_eventos(limit: int = 50):
     """
     Obtiene el log de eventos del sistema
     """
-    conn = sqlite3.connect('fire_detection.db')
-    cursor = conn.cursor()
-    
-    cursor.execute('''
+    cursor = conexion_db().execute('''
         SELECT timestamp, tipo_evento, descripcion, datos_json
         FROM eventos
         ORDER BY id DESC
@@ -909,7 +1603,6 @@ async def obtener_eventos(limit: int = 50):
     ''', (limit,))
     
     resultados = cursor.fetchall()
-    conn.close()
     
     eventos = []
     for row in resultados:
@@ -917,7 +1610,7 @@ async def obtener_eventos(limit: int = 50):
             "timestamp": row[0],
             "tipo": row[1],
             "descripcion": row[2],
-            "datos": json.loads(row[3]) if row[3] else None
+            "datos": loads_texto(row[3]) if row[3] else None
         })
     
     return {
@@ -929,9 +1622,7 @@ async def obtener_eventos(limit: int = 50):
 async def obtener_ultimas_fotos(limit: int = 5):
     """Devuelve las últimas `limit` fotos analizadas por la IA (rutas relativas)."""
     try:
-        conn = sqlite3.connect('fire_detection.db')
-        cursor = conn.cursor()
-        cursor.execute('''
+        cursor = conexion_db().execute('''
             SELECT imagen_path
             FROM analisis_ia
             WHERE imagen_path IS NOT NULL
@@ -939,7 +1630,6 @@ async def obtener_ultimas_fotos(limit: int = 5):
             LIMIT ?
         ''', (limit,))
         rows = cursor.fetchall()
-        conn.close()
 
         fotos = [row[0] for row in rows]
         return {
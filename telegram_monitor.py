@@ -6,13 +6,27 @@ Monitorea el bot de Telegram para recibir fotos enviadas por el usuario
 
 import time
 import requests
-import base64
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from datetime import datetime
+# orjson es opcional: si está instalado serializa los mensajes más rápido
+try:
+    import orjson
+except ImportError:
+    orjson = None
 from telegram_config import TELEGRAM_BOT_TOKEN, TELEGRAM_CHAT_ID
 
 # URL del servidor local
 SERVER_URL = "http://localhost:5000"
 
+# Sesión HTTP compartida: mantiene abiertas (keep-alive) las conexiones con
+# api.telegram.org y con el servidor local, así cada consulta no repite el
+# handshake TCP+TLS. Los GET se reintentan ante fallos de conexión; los POST
+# no, para no enviar dos veces la misma foto o mensaje
+SESSION = requests.Session()
+SESSION.mount('https://', HTTPAdapter(max_retries=Retry(total=3, backoff_factor=0.3)))
+SESSION.mount('http://', HTTPAdapter(max_retries=Retry(total=3, backoff_factor=0.3)))
+
 # Variable para rastrear el último update procesado
 last_update_id = 0
 
@@ -27,7 +41,7 @@ def obtener_actualizaciones():
     }
     
     try:
-        response = requests.get(url, params=params, timeout=35)
+        response = SESSION.get(url, params=params, timeout=35)
         data = response.json()
         
         if data.get("ok"):
@@ -40,12 +54,15 @@ def obtener_actualizaciones():
         return []
 
 def descargar_foto(file_id):
-    """Descarga una foto de Telegram y la convierte a base64"""
+    """
+    Abre la descarga de una foto de Telegram como stream: devuelve la
+    respuesta sin leer el cuerpo, que se reenvía tal cual al servidor
+    """
     # Obtener ruta del archivo
     url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/getFile"
     params = {"file_id": file_id}
     
-    response = requests.get(url, params=params)
+    response = SESSION.get(url, params=params)
     data = response.json()
     
     if not data.get("ok"):
@@ -56,28 +73,33 @@ def descargar_foto(file_id):
     
     # Descargar archivo
     download_url = f"https://api.telegram.org/file/bot{TELEGRAM_BOT_TOKEN}/{file_path}"
-    response = requests.get(download_url)
+    response = SESSION.get(download_url, stream=True, timeout=30)
     
     if response.status_code == 200:
-        # Convertir a base64
-        imagen_base64 = base64.b64encode(response.content).decode('utf-8')
-        return f"data:image/jpeg;base64,{imagen_base64}"
+        # Leer el cuerpo ya descomprimido si el servidor usa gzip
+        response.raw.decode_content = True
+        return response
     else:
         print(f"⚠️  Error al descargar foto (código {response.status_code})")
+        response.close()
         return None
 
-def enviar_foto_al_servidor(imagen_base64):
-    """Envía la foto al servidor para análisis"""
-    url = f"{SERVER_URL}/api/upload"
+def enviar_foto_al_servidor(foto):
+    """
+    Envía la foto al servidor para análisis como multipart/form-data
+    (en binario, sin codificar en base64). `foto` es la respuesta abierta
+    por descargar_foto y se cierra al terminar
+    """
+    url = f"{SERVER_URL}/api/upload/archivos"
     
-    payload = {
-        "imagen": imagen_base64,
-        "audio": None,
-        "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    datos = {
+        "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "dispositivo": "telegram"
     }
+    archivos = {"imagen": ("telegram.jpg", foto.raw, "image/jpeg")}
     
     try:
-        response = requests.post(url, json=payload, timeout=10)
+        response = SESSION.post(url, data=datos, files=archivos, timeout=30)
         if response.status_code == 200:
             data = response.json()
             print(f"✅ Foto enviada al servidor para análisis")
@@ -97,6 +119,8 @@ def enviar_foto_al_servidor(imagen_base64):
     except Exception as e:
         print(f"⚠️  Error al enviar foto al servidor: {e}")
         return False
+    finally:
+        foto.close()
 
 def enviar_mensaje(texto):
     """Envía un mensaje de confirmación al usuario"""
@@ -108,7 +132,11 @@ def enviar_mensaje(texto):
     }
     
     try:
-        requests.post(url, json=payload)
+        if orjson is not None:
+            SESSION.post(url, data=orjson.dumps(payload),
+                         headers={"Content-Type": "application/json"})
+        else:
+            SESSION.post(url, json=payload)
     except:
         pass
 
@@ -139,12 +167,12 @@ def procesar_actualizaciones(updates):
             print(f"📷 Foto recibida de Telegram (file_id: {file_id[:20]}...)")
             
             # Descargar foto
-            imagen_base64 = descargar_foto(file_id)
-            if imagen_base64:
-                print(f"✅ Foto descargada ({len(imagen_base64)} chars)")
+            foto = descargar_foto(file_id)
+            if foto is not None:
+                print(f"✅ Descargando foto ({foto.headers.get('Content-Length', '?')} bytes)")
                 
                 # Enviar al servidor
-                if enviar_foto_al_servidor(imagen_base64):
+                if enviar_foto_al_servidor(foto):
                     enviar_mensaje("✅ Foto recibida y analizada correctamente")
                 else:
                     enviar_mensaje("⚠️ Error al procesar la foto en el servidor")
@@ -158,7 +186,7 @@ def procesar_actualizaciones(updates):
                 if texto == "/estado":
                     # Consultar estado del sistema
                     try:
-                        response = requests.get(f"{SERVER_URL}/api/estado")
+                        response = SESSION.get(f"{SERVER_URL}/api/estado")
                         if response.status_code == 200:
                             estado = response.json()
                             msg = f"*Estado del Sistema:* {estado['estado']}\n\n"